@@ -20,6 +20,8 @@ import error.OTMException;
 import jaxb.Controller;
 import runner.Scenario;
 import java.util.Collection;
+import java.util.HashMap;
+import java.util.Map;
 
 import com.google.common.collect.ArrayListMultimap;
 
@@ -29,6 +31,10 @@ public class ControllerSignalPretimedInternal extends AbstractController {
     public Integer current_schedule_item_index;
     // Create a multimap of schedules across the actuators present
     public ArrayListMultimap<Long, ScheduleItem> assignedSchedules;
+    // Every actuator of the controller. initialize drops the actuators
+    // without a schedule from `actuators` for one run; they are put back
+    // before the next one, as the scenario is reused across runs.
+    private Map<Long, AbstractActuator> allActuators;
     ///////////////////////////////////////////////////
     // construction
     ///////////////////////////////////////////////////
@@ -83,9 +89,24 @@ public class ControllerSignalPretimedInternal extends AbstractController {
         super.poke(dispatcher, timestamp);
     }
     
+    public void restoreActuators(){
+        if (allActuators != null) {
+            actuators.clear();
+            actuators.putAll(allActuators);
+        }
+    }
+
+    public boolean controlsActuator(Long actuatorId){
+        return (allActuators != null ? allActuators : actuators).containsKey(actuatorId);
+    }
+
     @Override
     public void initialize(Scenario scenario,float now) throws OTMException {
         // System.out.println("INITIALIZING");
+        if (allActuators == null)
+            allActuators = new HashMap<>(actuators);
+        else
+            restoreActuators();
         this.actuators.values().removeIf(act -> !assignedSchedules.containsKey(act.id));
         // for (RoadConnection rc : scenario.network.road_connections.values()){
         //     System.out.printf("%s - %s\n", rc, rc.external_max_flow_vps);
@@ -1,5 +1,12 @@
 import com.google.gson.Gson;
 import py4j.GatewayServer;
+import java.lang.management.GarbageCollectorMXBean;
+import java.lang.management.ManagementFactory;
+import java.lang.management.MemoryPoolMXBean;
+import java.lang.management.MemoryType;
+import java.lang.management.MemoryUsage;
+import java.nio.ByteBuffer;
+import java.nio.ByteOrder;
 import java.util.*;
 import output.*;
 
@@ -8,10 +15,18 @@ public class EntryPointOTM {
 
     public ExposedAPI api;
     private Gson gson;
+    // Outputs added through requestOutput, addressed by their index
+    private List<AbstractOutput> requestedOutputs;
+    // Time spent packing outputs since the last takePackNanos call
+    private long packNanos;
+    // Simulator states saved by snapshot, see ExposedAPI.snapshotState
+    private Map<String, Object[]> snapshots;
 
     public EntryPointOTM() {
         api = new ExposedAPI();
         gson = new Gson();
+        requestedOutputs = new ArrayList<AbstractOutput>();
+        snapshots = new HashMap<String, Object[]>();
     }
 
     public void initRequests(float sampleDt) {
@@ -25,6 +40,9 @@ public class EntryPointOTM {
         request_vehicle_travel_time, request_actuator, request_actuator,
         request_controller, request_controller
     */
+        // Drop the requests of a previous run so a loaded scenario can be rerun
+        api.clear_output_requests();
+        requestedOutputs.clear();
         api.request_links_veh(api.get_link_ids(), sampleDt);
         api.request_links_flow(api.get_link_ids(), sampleDt);
     }
@@ -55,6 +73,230 @@ public class EntryPointOTM {
         return gson.toJson(linkFlows);
     }
 
+    /*
+        Binary output path. Values are packed as little-endian doubles in a
+        link x time block whose rows follow the order of generateLinkIdsBytes,
+        so that the Python side can wrap them with numpy.frombuffer without
+        boxing each sample.
+    */
+    public byte[] generateLinkIdsBytes() {
+        List<Long> linkIds = api.get_link_ids();
+        ByteBuffer buffer = ByteBuffer.allocate(8 * linkIds.size()).order(ByteOrder.LITTLE_ENDIAN);
+        for (Long linkId : linkIds)
+            buffer.putLong(linkId);
+        return buffer.array();
+    }
+
+    public byte[] generateLinkVehBytes() {
+        List<List<Double>> rows = new ArrayList<List<Double>>();
+        for (AbstractOutput output: api.get_output_data()) {
+            if (output instanceof LinkVehicles) {
+                LinkVehicles outputVeh = (LinkVehicles) output;
+                for (Long linkId : api.get_link_ids())
+                    rows.add(outputVeh.linkprofiles.get(linkId).profile.values);
+            }
+        }
+        return packRows(rows);
+    }
+
+    public byte[] generateLinkFlowBytes() {
+        List<List<Double>> rows = new ArrayList<List<Double>>();
+        for (AbstractOutput output: api.get_output_data()) {
+            if (output instanceof LinkFlow) {
+                LinkFlow outputFlow = (LinkFlow) output;
+                for (Long linkId : api.get_link_ids())
+                    rows.add(outputFlow.get_flow_for_link_in_vph(linkId));
+            }
+        }
+        return packRows(rows);
+    }
+
+    /*
+        Selective output requests. Each call registers one output and returns
+        the index under which its ids and samples can be fetched. An empty
+        idBytes block means all the links (or, with a non-negative
+        subnetworkId, all the links of that subnetwork); path travel time and
+        subnetwork VHT use subnetworkId as the path/subnetwork to record.
+    */
+    public void clearRequests() {
+        api.clear_output_requests();
+        requestedOutputs.clear();
+    }
+
+    public int requestOutput(String kind, byte[] idBytes, long subnetworkId, float sampleDt) {
+        List<Long> ids = unpackIds(idBytes);
+        if (ids.isEmpty())
+            ids = subnetworkId >= 0 ? new ArrayList<Long>(api.get_subnetwork_with_id(subnetworkId).get_link_ids())
+                                    : api.get_link_ids();
+        Set<AbstractOutput> existing = new HashSet<AbstractOutput>(api.get_output_data());
+        switch (kind) {
+            case "link_veh": api.request_links_veh(ids, sampleDt); break;
+            case "link_flw": api.request_links_flow(ids, sampleDt); break;
+            case "lanegroup_veh": api.request_lanegroup_veh(ids, sampleDt); break;
+            case "lanegroup_flw": api.request_lanegroup_flw(ids, sampleDt); break;
+            case "path_travel_time": api.request_path_travel_time(subnetworkId, sampleDt); break;
+            case "subnetwork_vht": api.request_subnetwork_vht(subnetworkId, sampleDt); break;
+            default: throw new IllegalArgumentException("Unknown output type: " + kind);
+        }
+        for (AbstractOutput output : api.get_output_data())
+            if (!existing.contains(output))
+                requestedOutputs.add(output);
+        return requestedOutputs.size() - 1;
+    }
+
+    public byte[] generateOutputIdsBytes(int index) {
+        List<Long> ids = outputIds(requestedOutputs.get(index));
+        ByteBuffer buffer = ByteBuffer.allocate(8 * ids.size()).order(ByteOrder.LITTLE_ENDIAN);
+        for (Long id : ids)
+            buffer.putLong(id);
+        return buffer.array();
+    }
+
+    public byte[] generateOutputBytes(int index) {
+        long start = System.nanoTime();
+        AbstractOutput output = requestedOutputs.get(index);
+        List<List<Double>> rows = new ArrayList<List<Double>>();
+        for (Long id : outputIds(output))
+            rows.add(new ArrayList<Double>(outputRow(output, id)));
+        byte[] packed = packRows(rows);
+        packNanos += System.nanoTime() - start;
+        return packed;
+    }
+
+    public long takePackNanos() {
+        long nanos = packNanos;
+        packNanos = 0;
+        return nanos;
+    }
+
+    /*
+        Streaming variant for stepwise runs: only the samples recorded since
+        the previous call are packed, and they are then dropped from the
+        output profiles so the JVM keeps a bounded history.
+    */
+    public byte[] drainOutputBytes(int index) {
+        byte[] packed = generateOutputBytes(index);
+        AbstractOutput output = requestedOutputs.get(index);
+        for (Long id : outputIds(output)) {
+            List<Double> samples = outputSamples(output, id);
+            // Flows are differences of cumulative counts, keep the last
+            // count so the next chunk starts from it
+            int keep = (output instanceof LinkFlow || output instanceof LaneGroupFlow) ? 1 : 0;
+            if (samples.size() > keep)
+                samples.subList(0, samples.size() - keep).clear();
+        }
+        return packed;
+    }
+
+    private List<Long> outputIds(AbstractOutput output) {
+        if (output instanceof LinkVehicles)
+            return new ArrayList<Long>(((LinkVehicles) output).linkprofiles.keySet());
+        if (output instanceof LinkFlow)
+            return new ArrayList<Long>(((LinkFlow) output).linkprofiles.keySet());
+        if (output instanceof LaneGroupVehicles)
+            return new ArrayList<Long>(((LaneGroupVehicles) output).lgprofiles.keySet());
+        if (output instanceof LaneGroupFlow)
+            return new ArrayList<Long>(((LaneGroupFlow) output).lgprofiles.keySet());
+        if (output instanceof PathTravelTime)
+            return Collections.singletonList(((PathTravelTime) output).get_path_id());
+        if (output instanceof SubnetworkVHT)
+            return Collections.singletonList(((SubnetworkVHT) output).get_subnetwork_id());
+        return new ArrayList<Long>();
+    }
+
+    private List<Double> outputRow(AbstractOutput output, Long id) {
+        if (output instanceof LinkFlow)
+            return ((LinkFlow) output).get_flow_for_link_in_vph(id);
+        if (output instanceof LaneGroupFlow)
+            return ((LaneGroupFlow) output).get_flow_for_lanegroup_in_vph(id);
+        return outputSamples(output, id);
+    }
+
+    // Raw recorded samples, cumulative counts for the flow outputs
+    private List<Double> outputSamples(AbstractOutput output, Long id) {
+        if (output instanceof LinkVehicles)
+            return ((LinkVehicles) output).linkprofiles.get(id).profile.values;
+        if (output instanceof LinkFlow)
+            return ((LinkFlow) output).linkprofiles.get(id).profile.values;
+        if (output instanceof LaneGroupVehicles)
+            return ((LaneGroupVehicles) output).lgprofiles.get(id).profile.values;
+        if (output instanceof LaneGroupFlow)
+            return ((LaneGroupFlow) output).lgprofiles.get(id).profile.values;
+        if (output instanceof PathTravelTime)
+            return ((PathTravelTime) output).get_travel_times_sec();
+        if (output instanceof SubnetworkVHT)
+            return ((SubnetworkVHT) output).get_vht();
+        return new ArrayList<Double>();
+    }
+
+    private static List<Long> unpackIds(byte[] idBytes) {
+        ByteBuffer buffer = ByteBuffer.wrap(idBytes).order(ByteOrder.LITTLE_ENDIAN);
+        List<Long> ids = new ArrayList<Long>();
+        while (buffer.remaining() >= 8)
+            ids.add(buffer.getLong());
+        return ids;
+    }
+
+    private static byte[] packRows(List<List<Double>> rows) {
+        int numSamples = rows.isEmpty() ? 0 : rows.get(0).size();
+        ByteBuffer buffer = ByteBuffer.allocate(8 * rows.size() * numSamples).order(ByteOrder.LITTLE_ENDIAN);
+        for (List<Double> row : rows)
+            for (int idx = 0; idx < numSamples; idx++)
+                buffer.putDouble(row.get(idx));
+        return buffer.array();
+    }
+
+    /*
+        Saves the running simulation, with its requested outputs, under name.
+        restore puts a copy of it back so that many continuations can be run
+        from the same point, e.g. after a warm-up period.
+    */
+    public void snapshot(String name) {
+        snapshots.put(name, api.snapshotState(requestedOutputs));
+    }
+
+    @SuppressWarnings("unchecked")
+    public void restore(String name) {
+        Object[] state = snapshots.get(name);
+        if (state == null)
+            throw new IllegalArgumentException("No snapshot named " + name);
+        requestedOutputs = (List<AbstractOutput>) api.restoreState(state)[0];
+    }
+
+    public void dropSnapshot(String name) {
+        snapshots.remove(name);
+    }
+
+    /*
+        Heap telemetry as little-endian longs: used, committed and max heap,
+        the heap retained after the last garbage collection (0 before the
+        first one), which does not count garbage still waiting to be
+        collected, and the number and total milliseconds of collections.
+    */
+    public static byte[] heapTelemetry() {
+        Runtime runtime = Runtime.getRuntime();
+        long retained = 0;
+        for (MemoryPoolMXBean pool : ManagementFactory.getMemoryPoolMXBeans()) {
+            MemoryUsage afterGc = pool.getCollectionUsage();
+            if (pool.getType() == MemoryType.HEAP && afterGc != null)
+                retained += afterGc.getUsed();
+        }
+        long gcCount = 0;
+        long gcMillis = 0;
+        for (GarbageCollectorMXBean collector : ManagementFactory.getGarbageCollectorMXBeans()) {
+            gcCount += Math.max(collector.getCollectionCount(), 0);
+            gcMillis += Math.max(collector.getCollectionTime(), 0);
+        }
+        ByteBuffer buffer = ByteBuffer.allocate(8 * 6).order(ByteOrder.LITTLE_ENDIAN);
+        buffer.putLong(runtime.totalMemory() - runtime.freeMemory());
+        buffer.putLong(runtime.totalMemory());
+        buffer.putLong(runtime.maxMemory());
+        buffer.putLong(retained);
+        buffer.putLong(gcCount);
+        buffer.putLong(gcMillis);
+        return buffer.array();
+    }
+
     public static void main(String[] args) {
         EntryPointOTM app = new EntryPointOTM();
         GatewayServer server = new GatewayServer(app);
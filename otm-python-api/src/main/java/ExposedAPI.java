@@ -1,8 +1,32 @@
+import actuator.AbstractActuator;
+import actuator.sigint.ActuatorSignal;
 import control.sigint.ScheduleItem;
 import control.sigint.Stage;
 import api.API;
+import com.esotericsoftware.kryo.Kryo;
+import com.github.luben.zstd.ZstdInputStream;
+import com.google.gson.Gson;
+import error.OTMException;
+import org.objenesis.strategy.StdInstantiatorStrategy;
+import runner.Scenario;
+import runner.ScenarioFactory;
+import xml.JaxbLoader;
 
+import javax.xml.XMLConstants;
+import javax.xml.bind.JAXBContext;
+import javax.xml.bind.JAXBException;
+import javax.xml.bind.Unmarshaller;
+import javax.xml.validation.SchemaFactory;
+import org.xml.sax.SAXException;
+
+import java.io.BufferedInputStream;
+import java.io.FileInputStream;
+import java.io.IOException;
+import java.io.InputStream;
+import java.nio.ByteBuffer;
+import java.nio.ByteOrder;
 import java.util.*;
+import java.util.zip.GZIPInputStream;
 
 public class ExposedAPI extends API {
     // Original API.java in otm-sim has a protected scenario, but
@@ -28,6 +52,299 @@ public class ExposedAPI extends API {
         insertActuatorSchedule(Long.valueOf(actuatorId), newSched);
     }
 
+    /*
+        Inserts the schedules of many actuators in one call. Actuator ids are
+        little-endian longs, offsets little-endian ints (one more than the
+        number of actuators) delimiting each actuator's stage durations, which
+        are little-endian doubles. The whole batch is validated first; the
+        rejected actuators are returned as a JSON map of id to reason. With
+        applyPartial false nothing is inserted if any actuator is rejected.
+        With replace each actuator's schedule items are replaced by the new
+        one, otherwise it is added to them as insertActuatorSchedule does.
+    */
+    public String insertActuatorSchedules(byte[] idBytes, byte[] offsetBytes, byte[] durationBytes,
+                                          boolean applyPartial){
+        return insertActuatorSchedules(idBytes, offsetBytes, durationBytes, applyPartial, true);
+    }
+
+    public String insertActuatorSchedules(byte[] idBytes, byte[] offsetBytes, byte[] durationBytes,
+                                          boolean applyPartial, boolean replace){
+        ByteBuffer ids = ByteBuffer.wrap(idBytes).order(ByteOrder.LITTLE_ENDIAN);
+        ByteBuffer offsets = ByteBuffer.wrap(offsetBytes).order(ByteOrder.LITTLE_ENDIAN);
+        ByteBuffer durations = ByteBuffer.wrap(durationBytes).order(ByteOrder.LITTLE_ENDIAN);
+        int numActuators = idBytes.length / 8;
+
+        Map<Long, String> rejected = new LinkedHashMap<>();
+        Map<Long, ScheduleItem> accepted = new LinkedHashMap<>();
+        ControllerSignalPretimedInternal masterControl = null;
+        for (Object controller : scenario.controllers.values())
+            if (controller instanceof ControllerSignalPretimedInternal)
+                masterControl = (ControllerSignalPretimedInternal) controller;
+
+        int start = offsets.getInt(0);
+        for (int idx = 0; idx < numActuators; idx++) {
+            Long actuatorId = ids.getLong(8 * idx);
+            int end = offsets.getInt(4 * (idx + 1));
+            AbstractActuator actuator = scenario.actuators.get(actuatorId);
+            String reason = null;
+            if (masterControl == null)
+                reason = "scenario has no ControllerSignalPretimedInternal controller";
+            else if (actuator == null)
+                reason = "no such actuator";
+            else if (!(actuator instanceof ActuatorSignal))
+                reason = "actuator is not a signal";
+            else if (!masterControl.controlsActuator(actuatorId))
+                reason = "actuator is not controlled by the ControllerSignalPretimedInternal controller";
+            else if (end <= start)
+                reason = "empty schedule";
+
+            List<Stage> stageList = new ArrayList<>();
+            for (int stage = 0; reason == null && stage < end - start; stage++) {
+                double duration = durations.getDouble(8 * (start + stage));
+                if (!(duration > 0) || Double.isInfinite(duration))
+                    reason = String.format("stage %d has invalid duration %s", stage, duration);
+                else if (!((ActuatorSignal) actuator).signal_phases.containsKey(Long.valueOf(stage)))
+                    reason = String.format("signal has no phase %d", stage);
+                else
+                    stageList.add(new Stage(stage, (float) duration, new Long[]{Long.valueOf(stage)}));
+            }
+            if (reason == null)
+                accepted.put(actuatorId, new ScheduleItem(0f, 0f, stageList));
+            else
+                rejected.put(actuatorId, reason);
+            start = end;
+        }
+
+        if (applyPartial || rejected.isEmpty()) {
+            for (Map.Entry<Long, ScheduleItem> entry : accepted.entrySet()) {
+                if (replace)
+                    masterControl.assignedSchedules.removeAll(entry.getKey());
+                masterControl.assignedSchedules.put(entry.getKey(), entry.getValue());
+            }
+            System.out.printf("Schedules for %d actuators inserted, %d rejected\n",
+                    accepted.size(), rejected.size());
+        }
+        return new Gson().toJson(rejected);
+    }
+
+    public void clearActuatorSchedules(){
+        // Removes the schedules inserted for a previous run of the scenario,
+        // and gives back the actuators that run left without a schedule
+        for (Object controller : scenario.controllers.values()){
+            if (controller instanceof ControllerSignalPretimedInternal) {
+                ((ControllerSignalPretimedInternal) controller).assignedSchedules.clear();
+                ((ControllerSignalPretimedInternal) controller).restoreActuators();
+            }
+        }
+    }
+
+    public void applyActuatorSchedules() throws OTMException {
+        // Schedules are normally handed to the signals when the scenario is
+        // initialized; this pushes the inserted ones to the signals of a
+        // scenario that is already running, e.g. one restored from a snapshot
+        float now = scenario.dispatcher.current_time;
+        for (Object controller : scenario.controllers.values()){
+            if (!(controller instanceof ControllerSignalPretimedInternal))
+                continue;
+            ControllerSignalPretimedInternal control = (ControllerSignalPretimedInternal) controller;
+            for (AbstractActuator actuator : control.actuators.values())
+                if (control.assignedSchedules.containsKey(actuator.id))
+                    ((ActuatorSignal) actuator).process_controller_command(
+                            control.get_command_for_actuator_id(actuator.id), scenario.dispatcher, now);
+        }
+    }
+
+    /*
+        Input mutation. The parsed XML (jaxb) scenario is kept after loading
+        so that demands, splits and road parameters can be changed in memory
+        and the simulator scenario rebuilt from it, without writing and
+        reloading a file. The loaded inputs are kept aside so that
+        resetInputs can go back to them. Values are comma separated, as in
+        the XML; NaN (or a negative id) leaves a field as it is.
+    */
+    private jaxb.Scenario jaxbScenario;
+    private jaxb.Scenario jaxbLoaded;
+    private boolean validate;
+    // jaxbScenario differs from jaxbLoaded / from what scenario was built from
+    private boolean inputsModified;
+    private boolean inputsChanged;
+
+    @Override
+    public void load(String configfile, boolean validate) throws OTMException {
+        jaxbScenario = isCompressed(configfile) ? loadCompressed(configfile, validate)
+                                                : JaxbLoader.load_scenario(configfile, validate);
+        jaxbLoaded = kryo().copy(jaxbScenario);
+        this.validate = validate;
+        inputsModified = false;
+        inputsChanged = false;
+        scenario = ScenarioFactory.create_scenario(jaxbScenario, validate);
+    }
+
+    /*
+        .xml.gz and .xml.zst scenarios are unmarshalled straight from the
+        decompressing stream, nothing is expanded to disk.
+    */
+    private static boolean isCompressed(String configfile) {
+        return configfile.endsWith(".gz") || configfile.endsWith(".zst");
+    }
+
+    private static jaxb.Scenario loadCompressed(String configfile, boolean validate) throws OTMException {
+        try (InputStream file = new BufferedInputStream(new FileInputStream(configfile), 1 << 16);
+             InputStream stream = configfile.endsWith(".gz") ? new GZIPInputStream(file, 1 << 16)
+                                                             : new ZstdInputStream(file)) {
+            Unmarshaller unmarshaller = JAXBContext.newInstance(jaxb.Scenario.class).createUnmarshaller();
+            if (validate)
+                unmarshaller.setSchema(SchemaFactory.newInstance(XMLConstants.W3C_XML_SCHEMA_NS_URI)
+                        .newSchema(JaxbLoader.class.getResource("/otm.xsd")));
+            return (jaxb.Scenario) unmarshaller.unmarshal(stream);
+        } catch (IOException | JAXBException | SAXException e) {
+            throw new OTMException("Could not read " + configfile + ": " + e.getMessage());
+        }
+    }
+
+    public void setDemand(long commodityId, long linkId, long subnetworkId, String values,
+                          double dt, double startTime) {
+        int matched = 0;
+        if (jaxbScenario.getDemands() != null)
+            for (jaxb.Demand demand : jaxbScenario.getDemands().getDemand()) {
+                if (demand.getCommodityId() != commodityId)
+                    continue;
+                if (linkId >= 0 && !Long.valueOf(linkId).equals(demand.getLinkId()))
+                    continue;
+                if (subnetworkId >= 0 && !Long.valueOf(subnetworkId).equals(demand.getSubnetwork()))
+                    continue;
+                demand.setContent(values);
+                if (!Double.isNaN(dt))
+                    demand.setDt((float) dt);
+                if (!Double.isNaN(startTime))
+                    demand.setStartTime((float) startTime);
+                matched++;
+            }
+        if (matched == 0)
+            throw new IllegalArgumentException(String.format(
+                    "No demand for commodity %d, link %d, subnetwork %d", commodityId, linkId, subnetworkId));
+        inputsModified = inputsChanged = true;
+    }
+
+    public void setSplit(long nodeId, long linkIn, long commodityId, long linkOut, String values,
+                         double dt, double startTime) {
+        if (jaxbScenario.getSplits() != null)
+            for (jaxb.SplitNode splitNode : jaxbScenario.getSplits().getSplitNode()) {
+                if (splitNode.getNodeId() != nodeId || splitNode.getLinkIn() != linkIn
+                        || splitNode.getCommodityId() != commodityId)
+                    continue;
+                if (!Double.isNaN(dt))
+                    splitNode.setDt((float) dt);
+                if (!Double.isNaN(startTime))
+                    splitNode.setStartTime((float) startTime);
+                for (jaxb.Split split : splitNode.getSplit())
+                    if (split.getLinkOut() == linkOut) {
+                        split.setContent(values);
+                        inputsModified = inputsChanged = true;
+                        return;
+                    }
+                // a turn without a split yet
+                jaxb.Split split = new jaxb.Split();
+                split.setLinkOut(linkOut);
+                split.setContent(values);
+                splitNode.getSplit().add(split);
+                inputsModified = inputsChanged = true;
+                return;
+            }
+        throw new IllegalArgumentException(String.format(
+                "No split node %d for link %d and commodity %d", nodeId, linkIn, commodityId));
+    }
+
+    public void setRoadparam(long roadparamId, double capacity, double speed, double jamDensity) {
+        for (jaxb.Roadparam roadparam : jaxbScenario.getNetwork().getRoadparams().getRoadparam()) {
+            if (roadparam.getId() != roadparamId)
+                continue;
+            if (!Double.isNaN(capacity))
+                roadparam.setCapacity((float) capacity);
+            if (!Double.isNaN(speed))
+                roadparam.setSpeed((float) speed);
+            if (!Double.isNaN(jamDensity))
+                roadparam.setJamDensity((float) jamDensity);
+            inputsModified = inputsChanged = true;
+            return;
+        }
+        throw new IllegalArgumentException("No roadparam " + roadparamId);
+    }
+
+    public void setLinkRoadparam(long linkId, long roadparamId) {
+        for (jaxb.Link link : jaxbScenario.getNetwork().getLinks().getLink()) {
+            if (link.getId() != linkId)
+                continue;
+            link.setRoadparam(roadparamId);
+            inputsModified = inputsChanged = true;
+            return;
+        }
+        throw new IllegalArgumentException("No link " + linkId);
+    }
+
+    public void resetInputs() {
+        // Back to the loaded inputs, applied by the next rebuildScenario
+        if (!inputsModified)
+            return;
+        jaxbScenario = kryo().copy(jaxbLoaded);
+        inputsModified = false;
+        inputsChanged = true;
+    }
+
+    public boolean inputsChanged() {
+        return inputsChanged;
+    }
+
+    public void rebuildScenario() throws OTMException {
+        // The controllers are created anew, carry the inserted schedules over
+        List<ControllerSignalPretimedInternal> previous = new ArrayList<>();
+        for (Object controller : scenario.controllers.values())
+            if (controller instanceof ControllerSignalPretimedInternal)
+                previous.add((ControllerSignalPretimedInternal) controller);
+        scenario = ScenarioFactory.create_scenario(jaxbScenario, validate);
+        inputsChanged = false;
+        for (Object controller : scenario.controllers.values())
+            if (controller instanceof ControllerSignalPretimedInternal)
+                for (ControllerSignalPretimedInternal old : previous)
+                    ((ControllerSignalPretimedInternal) controller).assignedSchedules.putAll(
+                            old.assignedSchedules);
+    }
+
+    /*
+        Snapshots. The scenario holds the whole simulator state (network,
+        vehicles, controllers and the dispatcher with its pending events), so a
+        deep copy taken between two advance calls can be restored any number of
+        times to continue from that point. Objects pointing into the scenario,
+        like the output requests, are passed along and copied together with it
+        so that their copies point into the copied scenario.
+    */
+    private Kryo kryo;
+
+    private Kryo kryo() {
+        if (kryo == null) {
+            kryo = new Kryo();
+            kryo.setRegistrationRequired(false);
+            kryo.setReferences(true);
+            kryo.setInstantiatorStrategy(
+                    new Kryo.DefaultInstantiatorStrategy(new StdInstantiatorStrategy()));
+        }
+        return kryo;
+    }
+
+    public Object[] snapshotState(Object... attached) {
+        Object[] state = new Object[attached.length + 1];
+        state[0] = scenario;
+        System.arraycopy(attached, 0, state, 1, attached.length);
+        return kryo().copy(state);
+    }
+
+    public Object[] restoreState(Object[] state) {
+        // Copied again so the snapshot itself is never advanced
+        Object[] copy = kryo().copy(state);
+        scenario = (Scenario) copy[0];
+        return Arrays.copyOfRange(copy, 1, copy.length);
+    }
+
     public String initSignalStages() {
         // Assume that the network only uses a single global controller    
         return String.format("ACTUATORS: %s\nCONTROLLERS: %s",
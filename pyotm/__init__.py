@@ -1,9 +1,14 @@
-import pyotm.scenario
-import pyotm.simulation
-import pyotm.visualization
-import pyotm.generator
-import pyotm.preprocessing
+import importlib
 
 
-import pyotm.converter
-import pyotm.runner
\ No newline at end of file
+# Submodules are imported when first used, so that importing one of them
+# (pyotm.writer, pyotm.xmlstream...) does not pull in the optional
+# dependencies of the others (osmnx, matplotlib, py4j)
+_SUBMODULES = ('scenario', 'simulation', 'visualization', 'generator', 'preprocessing',
+               'converter', 'runner')
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module('pyotm.' + name)
+    raise AttributeError("module 'pyotm' has no attribute %r" % name)
@@ -0,0 +1,138 @@
+#!/usr/bin/env/python
+import threading
+import asyncio
+import queue
+
+from pyotm.pool import OTMWorkerPool, OTMWorkerError, Trial
+
+
+class AsyncOTMRunner(object):
+    """Awaitable simulations on an OTMWorkerPool.
+
+    Loading, running and extracting happen in the pool's worker processes;
+    a background thread collects the finished trials and resolves the
+    futures on the event loop that awaits them, so many scenarios can be
+    run concurrently from one loop.
+
+        async with AsyncOTMRunner(4, simulation_time=3600.0) as runner:
+            outputs = await asyncio.gather(
+                runner.run('line.xml'),
+                runner.run('signal.xml', {4: [30.0, 30.0]}, timeout=600))
+
+    Cancelling an awaiting task (or hitting its timeout) drops the trial
+    if it is still queued. A trial already running in a worker cannot be
+    interrupted, it finishes and its output is discarded.
+    """
+
+    def __init__(self, processes=None, pool=None, **pool_kwargs):
+        self.pool = pool or OTMWorkerPool(processes, **pool_kwargs)
+        self._owns_pool = pool is None
+        # task_id -> (loop, future) of the trials being awaited
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._collector = None
+
+    async def run(self, scenario, schedules=None, timeout=None, inputs=None, **settings):
+        """Runs `scenario` with the given {actuator_id: stage timings},
+        changed inputs (see OTMRunner.set_inputs) and runner settings
+        (simulation_time, sample_dt, outputs)."""
+        return await self.run_trial(
+            Trial(scenario, schedules, settings or None, inputs), timeout)
+
+    async def run_trial(self, trial, timeout=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            task_id = self.pool.submit(trial)
+            self._futures[task_id] = (loop, future)
+            self._start_collector()
+        future.add_done_callback(lambda f: self._cancelled(task_id) if f.cancelled() else None)
+        # wait_for cancels `future` on timeout, see _cancelled
+        return await asyncio.wait_for(future, timeout)
+
+    async def map(self, trials, timeout=None):
+        """Outputs of `trials` in order, each with its own `timeout`."""
+        return await asyncio.gather(*[self.run_trial(trial, timeout) for trial in trials])
+
+    def _cancelled(self, task_id):
+        with self._lock:
+            self._futures.pop(task_id, None)
+        self.pool.cancel(task_id)
+
+    def _start_collector(self):
+        if self._collector is None:
+            self._collector = threading.Thread(target=self._collect, daemon=True)
+            self._collector.start()
+
+    def _collect(self):
+        while True:
+            with self._lock:
+                # a later submit starts a new collector
+                if not self._futures:
+                    self._collector = None
+                    return
+            try:
+                task_id, output = self.pool.collect(timeout=0.5)
+            except queue.Empty:
+                continue
+            except OTMWorkerError as error:
+                if error.task_id is None:
+                    self._fail_all(error)
+                    return
+                self._resolve(error.task_id, error=error)
+                continue
+            self._resolve(task_id, output)
+
+    def _resolve(self, task_id, output=None, error=None):
+        with self._lock:
+            # None for trials that were cancelled while running
+            loop, future = self._futures.pop(task_id, (None, None))
+        if future is not None:
+            self._call_soon(loop, self._set_result, future, output, error)
+
+    def _fail_all(self, error):
+        with self._lock:
+            futures, self._futures = self._futures, {}
+            self._collector = None
+        for loop, future in futures.values():
+            self._call_soon(loop, self._set_result, future, None, error)
+
+    @staticmethod
+    def _call_soon(loop, callback, *args):
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # the awaiting loop has been closed in the meantime
+            pass
+
+    @staticmethod
+    def _set_result(future, output, error):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(output)
+
+    async def close(self):
+        """Waits for the workers to finish and stops the pool (if it was
+        created here)."""
+        if self._owns_pool:
+            await asyncio.get_running_loop().run_in_executor(None, self.pool.close)
+
+    def terminate(self):
+        with self._lock:
+            futures, self._futures = self._futures, {}
+        for loop, future in futures.values():
+            self._call_soon(loop, future.cancel)
+        if self._owns_pool:
+            self.pool.terminate()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            await self.close()
+        else:
+            self.terminate()
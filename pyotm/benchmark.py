@@ -0,0 +1,176 @@
+#!/usr/bin/env/python
+"""Benchmarks the runner on the bundled scenarios.
+
+    python -m pyotm.benchmark --output bench.json
+    python -m pyotm.benchmark --output bench.json --baseline baseline.json
+
+Every scenario is loaded in a fresh JVM and run once per sample_dt x
+simulation_time setting. The results are written as JSON and, with
+`--baseline`, compared against an earlier results file; the exit status
+is 1 if any timing or memory figure regressed by more than `--tolerance`.
+The Python peak RSS is reset before each scenario where Linux allows it;
+`peak_rss_python_scope` says whether it is per scenario or cumulative.
+"""
+import argparse
+import datetime
+import platform
+import resource
+import json
+import sys
+import os
+
+from pyotm.gateway import GatewayManager
+from pyotm.runner import OTMRunner
+
+
+SCENARIO_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'examples', 'sample_configfiles')
+
+SCENARIOS = ['line.xml', 'mixing.xml', 'onramp_offramp.xml', 'signal.xml',
+             'intersections.xml', 'UPDiliman_small.xml',
+             'UPDiliman_small_splits_ctm.xml']
+
+SAMPLE_DTS = (5.0, 15.0, 60.0)
+SIMULATION_TIMES = (900.0, 3600.0)
+
+# Compared against the baseline, lower is better for all of them
+METRICS = ('load', 'simulate', 'extract', 'transfer', 'decode',
+           'peak_rss_python', 'peak_rss_jvm', 'heap_used')
+
+
+def peak_rss(pid=None):
+    """Peak resident set size in bytes of `pid`, or of this process, since
+    it started or since reset_peak_rss."""
+    try:
+        with open('/proc/%s/status' % (pid or 'self'), 'rt') as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    if pid is None:
+        # ru_maxrss is in kilobytes on Linux, and never goes down
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+def reset_peak_rss():
+    """Starts a new peak for peak_rss() of this process. Returns False
+    where that is not possible (no /proc/self/clear_refs, Linux < 4.0), the
+    peak then covers the whole process lifetime."""
+    try:
+        with open('/proc/self/clear_refs', 'wt') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def benchmark_scenario(filepath, sample_dts=SAMPLE_DTS,
+                       simulation_times=SIMULATION_TIMES, heap_size=None):
+    """Runs one scenario at every setting, returns one result per run."""
+    results = []
+    # otherwise every scenario would report the largest peak seen so far
+    peak_scope = 'scenario' if reset_peak_rss() else 'process'
+    with GatewayManager(heap_size=heap_size) as manager:
+        runner = OTMRunner(filepath, gateway=manager)
+        load_time = None
+        for simulation_time in simulation_times:
+            for sample_dt in sample_dts:
+                runner.reset(simulation_time=simulation_time, sample_dt=sample_dt)
+                timings = runner.run()['timings']
+                # the load is only timed once, with the first run
+                load_time = timings.get('load', load_time)
+                heap = timings['jvm']['heap_after'] or {}
+                results.append({
+                    'scenario': os.path.basename(filepath),
+                    'sample_dt': sample_dt,
+                    'simulation_time': simulation_time,
+                    'load': load_time,
+                    'requests': timings.get('requests'),
+                    'simulate': timings.get('simulate'),
+                    'extract': timings.get('extract'),
+                    'transfer': timings.get('transfer'),
+                    'decode': timings.get('decode'),
+                    'peak_rss_python': peak_rss(),
+                    'peak_rss_python_scope': peak_scope,
+                    'peak_rss_jvm': peak_rss(manager._process.pid),
+                    'heap_used': heap.get('used'),
+                    'heap_max': heap.get('max'),
+                    'gc_count': heap.get('gc_count'),
+                    'gc_time_ms': heap.get('gc_time_ms')})
+    return results
+
+
+def run_benchmarks(scenarios=SCENARIOS, scenario_dir=SCENARIO_DIR, **kwargs):
+    results = []
+    for scenario in scenarios:
+        print("Benchmarking {}".format(scenario))
+        results += benchmark_scenario(os.path.join(scenario_dir, scenario), **kwargs)
+    return {
+        'created': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results}
+
+
+def _key(result):
+    return (result['scenario'], result['sample_dt'], result['simulation_time'])
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Lists (scenario, sample_dt, simulation_time, metric, baseline, value)
+    for every metric more than `tolerance` (relative) above the baseline.
+    Settings or metrics missing from either file are skipped."""
+    previous = {_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        reference = previous.get(_key(result))
+        if reference is None:
+            continue
+        for metric in METRICS:
+            value, expected = result.get(metric), reference.get(metric)
+            if value is None or not expected:
+                continue
+            if metric == 'peak_rss_python' and result.get('peak_rss_python_scope', 'process') != \
+                    reference.get('peak_rss_python_scope', 'process'):
+                # a per-scenario peak is not comparable with a cumulative one
+                continue
+            if value > expected * (1 + tolerance):
+                regressions.append(_key(result) + (metric, expected, value))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks OTMRunner on the sample scenarios")
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--baseline', help="results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed relative increase over the baseline")
+    parser.add_argument('--scenarios', nargs='+', default=SCENARIOS)
+    parser.add_argument('--scenario-dir', default=SCENARIO_DIR)
+    parser.add_argument('--sample-dt', type=float, nargs='+', default=SAMPLE_DTS)
+    parser.add_argument('--simulation-time', type=float, nargs='+', default=SIMULATION_TIMES)
+    parser.add_argument('--heap-size', help="JVM -Xmx, e.g. 4g")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.scenarios, args.scenario_dir,
+                             sample_dts=args.sample_dt,
+                             simulation_times=args.simulation_time,
+                             heap_size=args.heap_size)
+    with open(args.output, 'wt') as output_file:
+        json.dump(results, output_file, indent=2)
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline, 'rt') as baseline_file:
+        regressions = compare(results, json.load(baseline_file), args.tolerance)
+    for scenario, sample_dt, simulation_time, metric, expected, value in regressions:
+        print("{} (sample_dt={}, simulation_time={}): {} {:.4g} -> {:.4g}".format(
+            scenario, sample_dt, simulation_time, metric, expected, value))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+#!/usr/bin/env/python
+import tempfile
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from pyotm import scenario
+from pyotm.network import Network
+
+
+# Bump whenever scenario.load or the layout written here changes, older
+# entries are then never read again and age out of the cache
+LOADER_VERSION = 1
+
+_ARRAYS = ('node_ids', 'node_xy', 'link_ids', 'source', 'target', 'lanes', 'length',
+           'roadparam', 'geometry_offsets', 'geometry_coords')
+
+
+def default_directory():
+    return os.environ.get('PYOTM_CACHE_DIR') or os.path.join(
+        os.path.expanduser('~'), '.cache', 'pyotm')
+
+
+def file_hash(filepath, chunk_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filepath, 'rb') as scenario_file:
+        for chunk in iter(lambda: scenario_file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _pack_column(prefix, name, values, arrays):
+    if values.dtype != object:
+        arrays[prefix + name] = values
+        return
+    # strings with None for missing values: text plus a mask
+    missing = np.array([value is None for value in values], dtype=bool)
+    arrays[prefix + name] = np.array(['' if value is None else str(value) for value in values],
+                                     dtype=str)
+    arrays[prefix + 'missing__' + name] = missing
+
+
+def _unpack_columns(prefix, arrays):
+    columns = {}
+    for key in arrays.files:
+        if not key.startswith(prefix) or key.startswith(prefix + 'missing__'):
+            continue
+        name = key[len(prefix):]
+        values = arrays[key]
+        if values.dtype.kind == 'U':
+            values = values.astype(object)
+            missing = prefix + 'missing__' + name
+            if missing in arrays.files:
+                values[arrays[missing]] = None
+        columns[name] = values
+    return columns
+
+
+def save_network(net, filepath):
+    """Writes the arrays of a Network to an .npz file, no pickling."""
+    arrays = {name: getattr(net, name) for name in _ARRAYS}
+    if arrays['node_ids'].dtype == object:
+        arrays['node_ids'] = arrays['node_ids'].astype(str)
+    for name, values in net.node_attrs.items():
+        _pack_column('node__', name, values, arrays)
+    for name, values in net.link_attrs.items():
+        _pack_column('link__', name, values, arrays)
+    graph = dict(net.graph)
+    graph.pop('crs', None)
+    arrays['graph'] = np.array(json.dumps(graph))
+    np.savez(filepath, **arrays)
+
+
+def load_network(filepath):
+    with np.load(filepath, allow_pickle=False) as arrays:
+        kwargs = {name: arrays[name] for name in _ARRAYS}
+        if kwargs['node_ids'].dtype.kind == 'U':
+            kwargs['node_ids'] = kwargs['node_ids'].astype(object)
+        graph = json.loads(arrays['graph'].item())
+        node_attrs = _unpack_columns('node__', arrays)
+        link_attrs = _unpack_columns('link__', arrays)
+    if 'roadconnections' in graph:
+        graph['roadconnections'] = [tuple(pair) for pair in graph['roadconnections']]
+    return Network(node_attrs=node_attrs, link_attrs=link_attrs, graph=graph, **kwargs)
+
+
+class ScenarioCache(object):
+    """On-disk cache of parsed scenario files.
+
+    Entries are the Network arrays of a scenario in .npz form, named after
+    the hash of the file's contents and LOADER_VERSION, so an edited file
+    or a new loader simply misses. Reading an entry marks it as recently
+    used; once the directory grows past `max_bytes` (or `max_entries`) the
+    least recently used entries are removed. Other data, such as the
+    rendered sections of pyotm.pipeline, is kept alongside with
+    store_bytes and load_bytes.
+
+        cache = ScenarioCache()
+        G = cache.load('UPDiliman_small_splits_ctm.xml')
+
+    The directory defaults to $PYOTM_CACHE_DIR or ~/.cache/pyotm.
+    """
+
+    def __init__(self, directory=None, max_bytes=512 * 1024 ** 2, max_entries=None):
+        self.directory = directory or default_directory()
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, filepath):
+        return "{}-v{}".format(file_hash(filepath), LOADER_VERSION)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def load_network(self, filepath, crs=None):
+        """Network of `filepath`, parsed only if it is not in the cache."""
+        path = self.path(self.key(filepath))
+        try:
+            net = load_network(path)
+        except (IOError, OSError, ValueError, KeyError):
+            # missing, or a partial or unreadable entry, parse again
+            net = None
+        if net is not None:
+            self.hits += 1
+            self._touch(path)
+        else:
+            self.misses += 1
+            net = Network.from_networkx(scenario.load(filepath))
+            self._store(path, lambda entry_file: save_network(net, entry_file))
+        net.graph['crs'] = crs
+        net.graph['name'] = filepath
+        return net
+
+    def load(self, filepath, crs=None):
+        """Same as pyotm.scenario.load, through the cache. A hit skips the
+        XML parse but still builds the whole networkx graph, which takes
+        about half as long as parsing; callers that reload often and can
+        work on arrays should use load_network, which takes a small
+        fraction of the time."""
+        return self.load_network(filepath, crs).to_networkx()
+
+    def load_bytes(self, key):
+        """Bytes stored under `key` by store_bytes, None if not cached."""
+        path = self.path(key)
+        try:
+            with np.load(path, allow_pickle=False) as arrays:
+                data = arrays['data'].tobytes()
+        except (IOError, OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touch(path)
+        return data
+
+    def store_bytes(self, key, data):
+        self._store(self.path(key), lambda entry_file: np.savez(
+            entry_file, data=np.frombuffer(data, dtype=np.uint8)))
+
+    def _touch(self, path):
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def _store(self, path, save):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # written under a temporary name so readers never see half a file
+            handle, temp_path = tempfile.mkstemp(suffix='.npz', dir=self.directory)
+            with os.fdopen(handle, 'wb') as entry_file:
+                save(entry_file)
+            os.replace(temp_path, path)
+        except OSError:
+            # a read-only or full disk only costs the speed-up
+            return
+        self.evict()
+
+    def entries(self):
+        """(path, size, last use) of every entry, least recently used first."""
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    @property
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        while entries and (total > self.max_bytes or
+                           (self.max_entries is not None and len(entries) > self.max_entries)):
+            path, size, _ = entries.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+_default_cache = None
+
+
+def load(filepath, crs=None, cache=None):
+    """pyotm.scenario.load through `cache`, a ScenarioCache in the default
+    directory if not given. The networkx graph is rebuilt on every call,
+    see ScenarioCache.load_network for the fast path."""
+    global _default_cache
+    if cache is None:
+        if _default_cache is None:
+            _default_cache = ScenarioCache()
+        cache = _default_cache
+    return cache.load(filepath, crs)
@@ -0,0 +1,43 @@
+#!/usr/bin/env/python
+"""Transparent (de)compression of scenario files by extension.
+
+    with open_scenario('UPDiliman_small_splits_ctm.xml.gz') as source:
+        tree = etree.parse(source)
+
+`.gz` uses the standard library, `.zst` the optional `zstandard` package;
+other files are opened as they are. Reading and writing both stream.
+"""
+import gzip
+
+
+COMPRESSED_SUFFIXES = ('.gz', '.zst')
+
+# gzip's default of 9 is several times slower for little gain on XML
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+
+
+def is_compressed(filepath):
+    return str(filepath).endswith(COMPRESSED_SUFFIXES)
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading or writing .zst scenarios needs the zstandard package")
+    return zstandard
+
+
+def open_scenario(filepath, mode='rb'):
+    """Binary file object for `filepath` ('rb' or 'wb'), compressed or
+    decompressed on the fly according to its extension."""
+    filepath = str(filepath)
+    if filepath.endswith('.gz'):
+        return gzip.open(filepath, mode, compresslevel=GZIP_LEVEL)
+    if filepath.endswith('.zst'):
+        zstandard = _zstandard()
+        if 'w' in mode:
+            return zstandard.open(filepath, mode, cctx=zstandard.ZstdCompressor(level=ZSTD_LEVEL))
+        return zstandard.open(filepath, mode)
+    return open(filepath, mode)
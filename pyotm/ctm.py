@@ -0,0 +1,415 @@
+#!/usr/bin/env/python
+"""Cell transmission model in NumPy, for screening many candidate
+scenarios without starting a JVM.
+
+The model is link-level: lane groups, road connection lanes and signals
+are not modelled, each commodity (and each path of a pathfull commodity)
+is tracked as a separate class of vehicles, and links without split
+ratios send their vehicles evenly to the links they connect to. Use
+`compare` to see how closely it follows the OTM simulation on a scenario.
+
+    outputs = run_batch(['line.xml', 'mixing.xml'], simulation_time=3600.0)
+    outputs[0]['link_veh'][1]   # same structure as OTMRunner.run()
+"""
+import math
+import time
+import sys
+import os
+
+import numpy as np
+
+from pyotm import scenario
+from pyotm.outputs import LinkSeries
+
+
+DEFAULT_SIM_DT = 2.0
+
+
+def _profile_table(profiles):
+    # Pads the profiles into one array so they are looked up together
+    width = max([len(profile['values']) for profile in profiles] or [1])
+    values = np.zeros((len(profiles), width))
+    lengths = np.ones(len(profiles), dtype=int)
+    for row, profile in enumerate(profiles):
+        values[row, :len(profile['values'])] = profile['values']
+        lengths[row] = max(len(profile['values']), 1)
+    start = np.array([profile['start_time'] for profile in profiles], dtype=float)
+    dt = np.array([profile['dt'] for profile in profiles], dtype=float)
+    return start, dt, lengths, values
+
+
+def _profile_index(table, now):
+    start, dt, lengths, _ = table
+    steps = np.floor((now - start) / np.where(dt > 0, dt, 1.0))
+    # the last value is held once a profile runs out
+    return np.clip(np.where(dt > 0, steps, 0), 0, lengths - 1).astype(int)
+
+
+def _pathfull(G, commodity_id):
+    commodity = G.graph['commodities'].get(commodity_id, {})
+    return str(commodity.get('pathfull', 'false')).lower() == 'true'
+
+
+def _compile(G, dt):
+    """Cell, movement, class and profile arrays of one scenario graph."""
+    edges = list(G.edges(data=True))
+    link_ids = np.array([int(attrib['id']) for _, _, attrib in edges], dtype=np.int64)
+    links = {attrib['id']: idx for idx, (_, _, attrib) in enumerate(edges)}
+    roadparams = G.graph['roadparams']
+    num_links = len(edges)
+
+    length = np.array([attrib['length'] for _, _, attrib in edges], dtype=float)
+    lanes = np.array([attrib['full_lanes'] for _, _, attrib in edges], dtype=float)
+    params = [roadparams[attrib['roadparam']] for _, _, attrib in edges]
+    capacity = np.array([param['capacity'] for param in params])    # veh/hr/lane
+    speed = np.array([param['speed'] for param in params]) / 3.6     # m/s
+    jam_density = np.array([param['jam_density'] for param in params]) / 1000.0  # veh/m/lane
+
+    # As many cells as max_cell_length asks for, but no shorter than a
+    # free-flow step so vehicles do not skip cells
+    num_cells = np.maximum(np.floor(length / (speed * dt)), 1)
+    max_cell_length = G.graph['model_params'].get('max_cell_length')
+    if max_cell_length:
+        num_cells = np.maximum(np.minimum(np.ceil(length / max_cell_length), num_cells), 1)
+    num_cells = num_cells.astype(int)
+    cell_link = np.repeat(np.arange(num_links), num_cells)
+    last = np.cumsum(num_cells) - 1
+    first = last - num_cells + 1
+    cell_length = (length / num_cells)[cell_link]
+
+    capacity_vps = capacity / 3600.0
+    wave_speed = capacity_vps / np.maximum(jam_density - capacity_vps / speed, 1e-9)
+    cells = {
+        'link': cell_link,
+        'max_flow': (capacity_vps * lanes * dt)[cell_link],
+        'free_flow': np.minimum(speed[cell_link] * dt / cell_length, 1.0),
+        'congestion': np.minimum(np.minimum(wave_speed, speed)[cell_link] * dt / cell_length, 1.0),
+        'jam': (jam_density * lanes)[cell_link] * cell_length}
+
+    # Movements between links meeting at a node, restricted to the road
+    # connections where the scenario has them
+    outgoing = {}
+    for idx, (start_node, _, _) in enumerate(edges):
+        outgoing.setdefault(start_node, []).append(idx)
+    connections = {}
+    for in_link, out_link in G.graph['roadconnections']:
+        if in_link in links and out_link in links:
+            connections.setdefault(links[in_link], set()).add(links[out_link])
+    mov_in, mov_out = [], []
+    for idx, (_, end_node, _) in enumerate(edges):
+        for out_idx in outgoing.get(end_node, []):
+            if idx not in connections or out_idx in connections[idx]:
+                mov_in.append(idx)
+                mov_out.append(out_idx)
+    mov_in = np.array(mov_in, dtype=int)
+    mov_out = np.array(mov_out, dtype=int)
+
+    # One class per pathless commodity and per path of a pathfull one. A
+    # pathless commodity may still name a subnetwork, it is not a path then
+    classes = {}
+    demands = []
+    for demand in G.graph['demands']:
+        if _pathfull(G, demand['commodity_id']):
+            key = (demand['commodity_id'], demand['subnetwork'])
+            entry = demand['link_id'] or G.graph['subnetworks'][demand['subnetwork']][0]
+        else:
+            key = (demand['commodity_id'], None)
+            entry = demand['link_id']
+        classes.setdefault(key, len(classes))
+        if entry not in links:
+            raise ValueError("Demand on unknown link %s in %s" % (entry, G.graph['name']))
+        demands.append((classes[key], links[entry], demand))
+
+    num_classes = max(len(classes), 1)
+    num_out = np.bincount(mov_in, minlength=num_links)
+    beta = np.zeros((num_classes, len(mov_in)))
+    exits = np.ones((num_classes, num_links))
+    for (commodity_id, subnetwork), k in classes.items():
+        if subnetwork is None:
+            beta[k] = 1.0 / num_out[mov_in]
+        else:
+            path = [links[link_id] for link_id in G.graph['subnetworks'][subnetwork]]
+            following = dict(zip(path[:-1], path[1:]))
+            beta[k] = [following.get(i) == j for i, j in zip(mov_in, mov_out)]
+        # vehicles leave at sinks and at the end of their path
+        exits[k] = 1.0 - np.minimum(np.bincount(mov_in, beta[k], minlength=num_links), 1.0)
+
+    movements = {(i, j): m for m, (i, j) in enumerate(zip(mov_in, mov_out))}
+    splits = []
+    for split_node in G.graph['splits']:
+        k = classes.get((split_node['commodity_id'], None))
+        if k is None or split_node['link_in'] not in links:
+            continue
+        for link_out, profile in split_node['splits'].items():
+            m = movements.get((links[split_node['link_in']], links.get(link_out)))
+            if m is not None:
+                splits.append((k, m, profile))
+
+    return {
+        'link_ids': link_ids, 'num_links': num_links, 'first': first, 'last': last,
+        'cells': cells, 'mov_in': mov_in, 'mov_out': mov_out,
+        'num_classes': num_classes, 'beta': beta, 'exits': exits,
+        'demands': demands, 'splits': splits}
+
+
+class CTMModel(object):
+    """One or more scenario graphs (see pyotm.scenario.load) compiled into
+    a single set of cell arrays, so a batch of scenarios is simulated with
+    the same vectorized updates as one. Scenarios are independent: their
+    cells are simply laid side by side.
+
+    All scenarios are stepped with the smallest `sim_dt` among them."""
+
+    def __init__(self, graphs, sim_dt=None):
+        self.graphs = list(graphs)
+        self.dt = float(sim_dt or min(G.graph['model_params'].get('sim_dt', DEFAULT_SIM_DT)
+                                      for G in self.graphs))
+        compiled = [_compile(G, self.dt) for G in self.graphs]
+
+        link_offsets = np.cumsum([0] + [c['num_links'] for c in compiled])
+        cell_offsets = np.cumsum([0] + [len(c['cells']['link']) for c in compiled])
+        mov_offsets = np.cumsum([0] + [len(c['mov_in']) for c in compiled])
+        self.num_links = int(link_offsets[-1])
+        self.num_cells = int(cell_offsets[-1])
+        self.num_classes = max(c['num_classes'] for c in compiled)
+        self.link_slices = [slice(start, end) for start, end in
+                            zip(link_offsets[:-1], link_offsets[1:])]
+        self.link_ids = [c['link_ids'] for c in compiled]
+
+        def stack(key, offsets):
+            return np.concatenate([c[key] + offset for c, offset in zip(compiled, offsets)])
+
+        self.first = stack('first', cell_offsets[:-1])
+        self.last = stack('last', cell_offsets[:-1])
+        self.cell_link = np.concatenate([c['cells']['link'] + offset for c, offset in
+                                         zip(compiled, link_offsets[:-1])])
+        for key in ['max_flow', 'free_flow', 'congestion', 'jam']:
+            setattr(self, key, np.concatenate([c['cells'][key] for c in compiled]))
+        self.mov_in = stack('mov_in', link_offsets[:-1])
+        self.mov_out = stack('mov_out', link_offsets[:-1])
+
+        # cells followed by another cell of the same link
+        internal = np.ones(self.num_cells, dtype=bool)
+        internal[self.last] = False
+        self.up = np.flatnonzero(internal)
+        self.down = self.up + 1
+
+        num_movements = int(mov_offsets[-1])
+        self.beta = np.zeros((self.num_classes, num_movements))
+        self.exits = np.ones((self.num_classes, self.num_links))
+        demands, splits = [], []
+        for c, links, movs in zip(compiled, self.link_slices, mov_offsets[:-1]):
+            self.beta[:c['num_classes'], movs:movs + len(c['mov_in'])] = c['beta']
+            self.exits[:c['num_classes'], links] = c['exits']
+            demands += [(k, link + links.start, profile) for k, link, profile in c['demands']]
+            splits += [(k, m + movs, profile) for k, m, profile in c['splits']]
+
+        # flat (class, index) positions for summing per class with bincount
+        classes = np.arange(self.num_classes)[:, None]
+        self._flat_in = (classes * self.num_links + self.mov_in).ravel()
+        self._flat_out = (classes * self.num_links + self.mov_out).ravel()
+
+        self.demand_class = np.array([k for k, _, _ in demands], dtype=int)
+        self.demand_link = np.array([link for _, link, _ in demands], dtype=int)
+        self.demand_table = _profile_table([profile for _, _, profile in demands])
+
+        # Split ratios replace the even split of their (class, link in); they
+        # are renormalised over the movements they cover
+        self.split_class = np.array([k for k, _, _ in splits], dtype=int)
+        self.split_mov = np.array([m for _, m, _ in splits], dtype=int)
+        self.split_table = _profile_table([profile for _, _, profile in splits])
+        covered = np.zeros((self.num_classes, self.num_links), dtype=bool)
+        covered[self.split_class, self.mov_in[self.split_mov]] = True
+        self._split_base = np.where(covered[:, self.mov_in], 0.0, self.beta)
+
+    def _split_ratios(self, now):
+        if not len(self.split_mov):
+            return self.beta
+        _, _, _, values = self.split_table
+        ratios = values[np.arange(len(values)), _profile_index(self.split_table, now)]
+        beta = self._split_base.copy()
+        beta[self.split_class, self.split_mov] = ratios
+        flat = self.split_class * self.num_links + self.mov_in[self.split_mov]
+        totals = np.bincount(flat, ratios, minlength=self.num_classes * self.num_links)
+        totals = totals.reshape(self.num_classes, self.num_links)[self.split_class, self.mov_in[self.split_mov]]
+        beta[self.split_class, self.split_mov] = np.where(
+            totals > 0, ratios / np.where(totals > 0, totals, 1.0),
+            self.beta[self.split_class, self.split_mov])
+        return beta
+
+    def _arrivals(self, now):
+        arrivals = np.zeros((self.num_classes, self.num_links))
+        if len(self.demand_link):
+            start, _, _, values = self.demand_table
+            rates = values[np.arange(len(values)), _profile_index(self.demand_table, now)]
+            rates = np.where(now >= start, rates, 0.0)
+            np.add.at(arrivals, (self.demand_class, self.demand_link), rates * self.dt / 3600.0)
+        return arrivals
+
+    def run(self, simulation_time, sample_dt=15.0):
+        """Simulates every scenario for `simulation_time` seconds, returns
+        one {'link_veh', 'link_flw'} output of LinkSeries per scenario:
+        vehicles on each link every `sample_dt` and the flow entering it,
+        in veh/hr, over each sample interval."""
+        start_time = time.perf_counter()
+        K, L = self.num_classes, self.num_links
+        n = np.zeros((K, self.num_cells))
+        queue = np.zeros((K, L))
+        entered = np.zeros(L)
+        num_steps = int(round(simulation_time / self.dt))
+        num_samples = int(math.floor(simulation_time / sample_dt + 1e-9)) + 1
+        vehicles = np.zeros((L, num_samples))
+        counts = np.zeros((L, num_samples))
+        sample = 0
+        split_index = None
+        beta = self.beta
+
+        for step in range(num_steps + 1):
+            now = step * self.dt
+            if sample < num_samples and now >= sample * sample_dt - 1e-9:
+                vehicles[:, sample] = np.bincount(self.cell_link, n.sum(0), minlength=L)
+                counts[:, sample] = entered
+                sample += 1
+            if step == num_steps:
+                break
+            if len(self.split_mov):
+                index = _profile_index(self.split_table, now)
+                if split_index is None or np.any(index != split_index):
+                    beta, split_index = self._split_ratios(now), index
+
+            total = n.sum(0)
+            composition = np.divide(n, total, out=np.zeros_like(n), where=total > 0)
+            sending = np.minimum(self.free_flow * total, self.max_flow)
+            receiving = np.clip(np.minimum(self.max_flow, self.congestion * (self.jam - total)), 0, None)
+
+            # within links
+            internal = np.minimum(sending[self.up], receiving[self.down]) * composition[:, self.up]
+
+            # across nodes: demands are scaled down evenly so that no link
+            # receives more than it can take, and an in-link is held back by
+            # its most restrictive movement (first in, first out)
+            link_sending = sending[self.last] * composition[:, self.last]
+            demand = link_sending[:, self.mov_in] * beta
+            movement_demand = demand.sum(0)
+            out_demand = np.bincount(self.mov_out, movement_demand, minlength=L)
+            out_receiving = receiving[self.first]
+            reduction = np.divide(out_receiving, out_demand, out=np.ones(L),
+                                  where=out_demand > out_receiving)
+            active = movement_demand > 0
+            held = np.ones(L)
+            np.minimum.at(held, self.mov_in[active], reduction[self.mov_out[active]])
+            moved = demand * held[self.mov_in]
+            moved_in = np.bincount(self._flat_out, moved.ravel(), minlength=K*L).reshape(K, L)
+            moved_out = np.bincount(self._flat_in, moved.ravel(), minlength=K*L).reshape(K, L)
+            moved_out += link_sending * self.exits * held
+
+            # demand waits upstream of its link until there is room
+            queue += self._arrivals(now)
+            room = np.maximum(out_receiving - moved_in.sum(0), 0)
+            queued = queue.sum(0)
+            admitted = queue * np.divide(np.minimum(queued, room), queued,
+                                         out=np.zeros(L), where=queued > 0)
+            queue -= admitted
+
+            n[:, self.up] -= internal
+            n[:, self.down] += internal
+            n[:, self.last] -= moved_out
+            n[:, self.first] += moved_in + admitted
+            entered += (moved_in + admitted).sum(0)
+
+        flows = np.diff(counts, axis=1) * 3600.0 / sample_dt
+        elapsed = time.perf_counter() - start_time
+        return [{'link_veh': LinkSeries(link_ids, vehicles[links]),
+                 'link_flw': LinkSeries(link_ids, flows[links]),
+                 'timings': {'simulate': elapsed}}
+                for link_ids, links in zip(self.link_ids, self.link_slices)]
+
+
+def _graph(item):
+    return scenario.load(item) if isinstance(item, str) else item
+
+
+def run_batch(scenarios, simulation_time=2*7200.0, sample_dt=15.0, sim_dt=None):
+    """Simulates scenario files or graphs together, returns their outputs
+    in order. For variants of one network, load it once and pass copies
+    with edited `G.graph['demands']`, splits or link attributes."""
+    return CTMModel([_graph(item) for item in scenarios], sim_dt).run(simulation_time, sample_dt)
+
+
+class CTMRunner(object):
+    """Stand-in for OTMRunner that simulates with the NumPy CTM."""
+
+    def __init__(self, otm_xml, **kwargs):
+        self.graph = _graph(otm_xml)
+        self.simulation_time = float(kwargs.get('simulation_time', 2*7200.0))
+        self.sample_dt = float(kwargs.get('sample_dt', 15.0))
+        self.model = CTMModel([self.graph], kwargs.get('sim_dt'))
+
+    def run(self):
+        return self.model.run(self.simulation_time, self.sample_dt)[0]
+
+
+def compare(otm_xml, simulation_time=3600.0, sample_dt=60.0, **runner_kwargs):
+    """Runs a scenario on OTM and on the NumPy CTM and returns, for each
+    output, the RMSE, the mean absolute error and the relative difference
+    of the totals over the links and samples both have."""
+    # imported here so the engine itself does not need py4j
+    from pyotm.runner import OTMRunner
+    otm_output = OTMRunner(otm_xml, simulation_time=simulation_time,
+                           sample_dt=sample_dt, **runner_kwargs).run()
+    ctm_output = CTMRunner(otm_xml, simulation_time=simulation_time, sample_dt=sample_dt).run()
+
+    metrics = {}
+    for name in ['link_veh', 'link_flw']:
+        expected, actual = otm_output[name], ctm_output[name]
+        link_ids = [link_id for link_id in expected.keys() if link_id in actual]
+        if not link_ids:
+            continue
+        expected = np.array([expected[link_id] for link_id in link_ids])
+        actual = np.array([actual[link_id] for link_id in link_ids])
+        width = min(expected.shape[1], actual.shape[1])
+        error = actual[:, :width] - expected[:, :width]
+        total = np.abs(expected[:, :width]).sum()
+        metrics[name] = {
+            'rmse': float(np.sqrt(np.mean(error**2))),
+            'mae': float(np.mean(np.abs(error))),
+            'total_difference': float(error.sum() / total) if total > 0 else None}
+    return metrics
+
+
+def check_generated(graphml=None):
+    """Regression check on a scenario written by writer.OTM_Model, whose
+    pathless commodity names subnetwork 1: vehicles entering at the source
+    link have to reach the links downstream of it."""
+    import tempfile
+    import igraph
+    from pyotm.writer import OTM_Model
+
+    graphml = graphml or os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                      'test2by2.graphml')
+    graph = igraph.read(graphml)
+    model = OTM_Model(graph)
+    model.add_splits()
+    source = graph.vs.find(_degree=1).index
+    model.add_demands(source, [600], 3600)
+    with tempfile.TemporaryDirectory() as directory:
+        otm_xml = os.path.join(directory, 'generated.xml')
+        model.write(otm_xml)
+        output = run_batch([scenario.load(otm_xml)], simulation_time=1800.0, sample_dt=60.0)[0]
+    entry = graph.incident(source, mode='out')[0]
+    link_veh = output['link_veh']
+    downstream = [idx for idx, link_id in enumerate(link_veh.link_ids) if link_id != entry]
+    reached = link_veh.array[downstream, -1].sum()
+    assert reached > 0, "No vehicles got past the entry link %d" % entry
+    return reached
+
+
+if __name__ == "__main__":
+    print("vehicles downstream of the entry link: %.1f" % check_generated())
+    configdir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'examples', 'sample_configfiles')
+    for configfile in ['line.xml', 'mixing.xml', 'onramp_offramp.xml', 'intersections.xml']:
+        for name, values in compare(os.path.join(configdir, configfile)).items():
+            print("{:20s} {:8s} rmse {rmse:10.3f}  mae {mae:10.3f}  total {total_difference}".format(
+                configfile, name, **values))
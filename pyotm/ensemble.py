@@ -0,0 +1,261 @@
+#!/usr/bin/env/python
+from statistics import NormalDist
+import math
+import numpy as np
+
+from pyotm.outputs import LinkSeries
+
+try:
+    from scipy.stats import t as _student_t
+except ImportError:
+    _student_t = None
+
+
+def t_quantile(p, df):
+    """Quantile `p` of Student's t with `df` degrees of freedom, from scipy
+    when it is installed. Otherwise exact for 1 and 2 degrees of freedom and
+    the Cornish-Fisher expansion in the normal quantile above (Abramowitz &
+    Stegun 26.7.5), within 0.2% at 3 degrees of freedom for p = 0.975."""
+    if _student_t is not None:
+        return float(_student_t.ppf(p, df))
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        return (2*p - 1) / math.sqrt(2*p * (1 - p))
+    z = NormalDist().inv_cdf(p)
+    terms = [(z**3 + z) / 4,
+             (5*z**5 + 16*z**3 + 3*z) / 96,
+             (3*z**7 + 19*z**5 + 17*z**3 - 15*z) / 384,
+             (79*z**9 + 776*z**7 + 1482*z**5 - 1920*z**3 - 945*z) / 92160]
+    return z + sum(term / df**power for power, term in enumerate(terms, 1))
+
+
+class RunningStats(object):
+    """Elementwise statistics over a stream of equally shaped arrays.
+
+    Keeps the count, mean and variance (Welford), min/max and P-square
+    estimates of the requested quantiles (Jain & Chlamtac, 1985), so
+    memory depends on the array shape only, not on the number of arrays
+    folded in. Quantiles are exact for the first five arrays."""
+
+    def __init__(self, quantiles=(0.05, 0.5, 0.95)):
+        self.quantiles = tuple(quantiles)
+        self.count = 0
+        self.mean = None
+        self._m2 = None
+        self.min = None
+        self.max = None
+        self._first = []
+        self._heights = None
+        self._positions = None
+        self._desired = None
+        self._increments = np.array(
+            [[0, p/2, p, (1+p)/2, 1] for p in self.quantiles])
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.count += 1
+        if self.count == 1:
+            self.mean = values.copy()
+            self._m2 = np.zeros_like(values)
+            self.min = values.copy()
+            self.max = values.copy()
+        else:
+            delta = values - self.mean
+            self.mean += delta / self.count
+            self._m2 += delta * (values - self.mean)
+            np.minimum(self.min, values, out=self.min)
+            np.maximum(self.max, values, out=self.max)
+
+        if self.count <= 5:
+            self._first.append(values.copy())
+            if self.count == 5:
+                self._start_markers()
+        else:
+            for heights, positions, desired, increments in zip(
+                    self._heights, self._positions, self._desired, self._increments):
+                self._update_markers(values, heights, positions, desired, increments)
+
+    def _start_markers(self):
+        ordered = np.sort(np.stack(self._first), axis=0)
+        shape = (5,) + ordered.shape[1:]
+        self._heights = [ordered.copy() for _ in self.quantiles]
+        self._positions = [np.ones(shape) * np.arange(1, 6).reshape((5,) + (1,)*(len(shape)-1))
+                           for _ in self.quantiles]
+        self._desired = [1 + 4*increments for increments in self._increments]
+        self._first = []
+
+    @staticmethod
+    def _update_markers(x, q, n, desired, increments):
+        # assigned, with 0-d values q[0] is a scalar and cannot be an `out`
+        q[0] = np.minimum(q[0], x)
+        q[4] = np.maximum(q[4], x)
+        # cell k such that q[k] <= x < q[k+1]
+        k = (x >= q[1]).astype(int) + (x >= q[2]) + (x >= q[3])
+        for i in range(1, 5):
+            n[i] += (k < i)
+        desired += increments
+        for i in range(1, 4):
+            d = desired[i] - n[i]
+            move = ((d >= 1) & (n[i+1] - n[i] > 1)) | ((d <= -1) & (n[i-1] - n[i] < -1))
+            if not move.any():
+                continue
+            d = np.where(move, np.sign(d), 0.0)
+            # piecewise-parabolic prediction, linear where it leaves the bracket
+            parabolic = q[i] + d / (n[i+1] - n[i-1]) * (
+                (n[i] - n[i-1] + d) * (q[i+1] - q[i]) / (n[i+1] - n[i]) +
+                (n[i+1] - n[i] - d) * (q[i] - q[i-1]) / (n[i] - n[i-1]))
+            neighbour = np.where(d > 0, i+1, i-1)
+            q_neighbour = np.where(d > 0, q[i+1], q[i-1])
+            n_neighbour = np.where(d > 0, n[i+1], n[i-1])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                linear = q[i] + d * (q_neighbour - q[i]) / (n_neighbour - n[i])
+            inside = (q[i-1] < parabolic) & (parabolic < q[i+1])
+            q[i] = np.where(move, np.where(inside, parabolic, linear), q[i])
+            n[i] += d
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return np.zeros_like(self.mean) if self.mean is not None else None
+        return self._m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    def half_width(self, confidence=0.95):
+        """Half-width of the Student-t confidence interval of the mean,
+        infinite until there are two values."""
+        if self.count < 2:
+            return np.full_like(self.mean, np.inf, dtype=float) if self.mean is not None else None
+        t = t_quantile(0.5 + confidence/2, self.count - 1)
+        return t * self.std / np.sqrt(self.count)
+
+    def quantile(self, q):
+        if q not in self.quantiles:
+            raise ValueError("Quantile %s is not tracked, use one of %s" % (q, self.quantiles))
+        if self.count < 5:
+            return np.quantile(np.stack(self._first), q, axis=0)
+        return self._heights[self.quantiles.index(q)][2].copy()
+
+
+class EnsembleStats(object):
+    """Folds runner outputs into per-output RunningStats as they arrive.
+
+        stats = EnsembleStats()
+        for trial, output in pool.imap_unordered(trials):
+            stats.update(output)
+        mean_flow = stats.mean('link_flw')  # LinkSeries
+
+    `kpis` maps names to functions of a runner output (e.g. the total
+    flow over all links); their values get the same statistics, returned
+    as (at least 1-D) arrays instead of LinkSeries.
+    """
+
+    def __init__(self, names=None, quantiles=(0.05, 0.5, 0.95), kpis=None):
+        self.names = names
+        self.quantiles = tuple(quantiles)
+        self.kpis = kpis or {}
+        self.stats = {}
+        self.link_ids = {}
+
+    @property
+    def count(self):
+        return max([s.count for s in self.stats.values()] or [0])
+
+    def update(self, output):
+        for name, series in output.items():
+            if not isinstance(series, LinkSeries):
+                continue
+            if self.names is not None and name not in self.names:
+                continue
+            if name not in self.stats:
+                self.stats[name] = RunningStats(self.quantiles)
+                self.link_ids[name] = series.link_ids
+            elif not np.array_equal(self.link_ids[name], series.link_ids):
+                raise ValueError("Output %s has a different link order than the previous runs" % name)
+            self.stats[name].update(series.array)
+        for name, kpi in self.kpis.items():
+            if name not in self.stats:
+                self.stats[name] = RunningStats(self.quantiles)
+                self.link_ids[name] = None
+            self.stats[name].update(np.atleast_1d(kpi(output)))
+
+    def __getitem__(self, name):
+        return self.stats[name]
+
+    def _series(self, name, values):
+        if self.link_ids[name] is None:
+            return values
+        return LinkSeries(self.link_ids[name], values)
+
+    def mean(self, name):
+        return self._series(name, self.stats[name].mean)
+
+    def variance(self, name):
+        return self._series(name, self.stats[name].variance)
+
+    def std(self, name):
+        return self._series(name, self.stats[name].std)
+
+    def min(self, name):
+        return self._series(name, self.stats[name].min)
+
+    def max(self, name):
+        return self._series(name, self.stats[name].max)
+
+    def quantile(self, name, q):
+        return self._series(name, self.stats[name].quantile(q))
+
+    def half_width(self, name, confidence=0.95):
+        """Student-t half-width per link, see RunningStats.half_width."""
+        return self._series(name, self.stats[name].half_width(confidence))
+
+
+class StoppingRule(object):
+    """Decides when an ensemble has enough replicates: once it has at least
+    `min_runs` and the confidence interval of the mean is within
+    max(`atol`, `rtol` * |mean|) for every link (or KPI value) of `names`,
+    by default of all the outputs tracked.
+
+        rule = StoppingRule(rtol=0.05, names=['total_flow'])
+        sweep = ParameterSweep(points, make_trial, replicates=256,
+                               stopping=rule, kpis={'total_flow': total_flow})
+    """
+
+    def __init__(self, rtol=0.05, atol=0.0, confidence=0.95, min_runs=5, names=None):
+        self.rtol = rtol
+        self.atol = atol
+        self.confidence = confidence
+        self.min_runs = max(min_runs, 2)
+        self.names = names
+
+    def converged(self, ensemble):
+        if ensemble.count < self.min_runs:
+            return False
+        for name in self.names or list(ensemble.stats):
+            stats = ensemble[name]
+            tolerance = np.maximum(self.atol, self.rtol * np.abs(stats.mean))
+            if np.any(stats.half_width(self.confidence) > tolerance):
+                return False
+        return True
+
+
+def check_scalar_updates(num_values=200):
+    """Check that RunningStats takes scalars as well as arrays: the mean,
+    extremes and median of a stream of floats match NumPy's."""
+    values = np.random.RandomState(0).normal(10.0, 2.0, num_values)
+    stats = RunningStats(quantiles=(0.5,))
+    for value in values:
+        stats.update(value)
+    assert stats.mean.shape == ()
+    assert np.isclose(stats.mean, values.mean()) and np.isclose(stats.std, values.std(ddof=1))
+    assert stats.min == values.min() and stats.max == values.max()
+    assert abs(stats.quantile(0.5) - np.median(values)) < 0.5
+    return stats
+
+
+if __name__ == "__main__":
+    stats = check_scalar_updates()
+    print("scalar updates: mean %.3f, median %.3f" % (stats.mean, stats.quantile(0.5)))
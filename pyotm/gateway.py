@@ -0,0 +1,104 @@
+#!/usr/bin/env/python
+from py4j.java_gateway import JavaGateway, launch_gateway, GatewayParameters
+import numpy as np
+import sys
+import os
+
+
+DEFAULT_CLASSPATH = os.path.join(
+    os.path.dirname(__file__),
+    'data/otm-python-api-1.0-SNAPSHOT-jar-with-dependencies.jar')
+
+HEAP_FIELDS = ('used', 'committed', 'max', 'retained', 'gc_count', 'gc_time_ms')
+
+
+class GatewayManager(object):
+    """Owns a py4j gateway to a JVM running the otm-python-api jar.
+
+    The JVM is only launched on first use (`gateway`/`jvm`) or on an
+    explicit `start()`, so importing pyotm does not cost a JVM. Settings
+    can be changed with `configure()` while the JVM is not running.
+
+        with GatewayManager(heap_size='4g') as manager:
+            runner = OTMRunner('line.xml', gateway=manager)
+    """
+
+    def __init__(self, heap_size=None, jvm_options=None, classpath=None):
+        self.heap_size = heap_size
+        self.jvm_options = list(jvm_options or [])
+        self.classpath = classpath or DEFAULT_CLASSPATH
+        self._gateway = None
+        self._process = None
+
+    def configure(self, heap_size=None, jvm_options=None, classpath=None):
+        if self.running:
+            raise RuntimeError("Cannot configure a running gateway, call shutdown() first")
+        if heap_size is not None:
+            self.heap_size = heap_size
+        if jvm_options is not None:
+            self.jvm_options = list(jvm_options)
+        if classpath is not None:
+            self.classpath = classpath
+
+    @property
+    def javaopts(self):
+        opts = ['-Xmx' + str(self.heap_size)] if self.heap_size else []
+        return opts + self.jvm_options
+
+    @property
+    def running(self):
+        return self._gateway is not None
+
+    @property
+    def gateway(self):
+        return self.start()
+
+    @property
+    def jvm(self):
+        return self.start().jvm
+
+    def start(self):
+        if self._gateway is None:
+            port, self._process = launch_gateway(
+                classpath=self.classpath, javaopts=self.javaopts,
+                die_on_exit=True, redirect_stdout=sys.stdout,
+                return_proc=True)
+            self._gateway = JavaGateway(gateway_parameters=GatewayParameters(
+                port=port, auto_field=True, auto_convert=True))
+        return self._gateway
+
+    def shutdown(self):
+        if self._gateway is None:
+            return
+        self._gateway.shutdown()
+        # die_on_exit makes the JVM exit once its stdin is closed
+        try:
+            self._process.stdin.close()
+            self._process.wait(timeout=10)
+        except Exception:
+            self._process.kill()
+        self._gateway = None
+        self._process = None
+
+    def heap_usage(self):
+        """JVM heap in bytes and garbage collection counters, see
+        EntryPointOTM.heapTelemetry, or None when the JVM is not running."""
+        if not self.running:
+            return None
+        values = np.frombuffer(self.jvm.EntryPointOTM.heapTelemetry(), dtype='<i8')
+        return dict(zip(HEAP_FIELDS, values.tolist()))
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+# Shared by the runner classes unless they are handed their own manager
+common_gateway = GatewayManager()
+
+
+def configure(**settings):
+    common_gateway.configure(**settings)
@@ -0,0 +1,298 @@
+#!/usr/bin/env/python
+import numpy as np
+import shapely
+
+from pyotm import scenario
+from pyotm.scenario import OTMGraph, _LazyGeometry
+
+
+def _csr(nodes, num_nodes):
+    # Links grouped by node: links[offsets[i]:offsets[i+1]] belong to node i
+    links = np.argsort(nodes, kind='stable')
+    offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(nodes, minlength=num_nodes), out=offsets[1:])
+    return offsets, links
+
+
+def _ids(values):
+    # Integer ids where they all are integers, the values as they are otherwise
+    try:
+        return np.array([int(value) for value in values], dtype=np.int64)
+    except (TypeError, ValueError):
+        return np.array(list(values), dtype=object)
+
+
+def _attribute_array(values):
+    # numeric arrays for numbers, object arrays keep strings and missing (None) values
+    values = list(values)
+    if values and all(isinstance(value, (int, float, np.number)) for value in values):
+        return np.array(values)
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _geometry_buffers(geometries):
+    """Flat coordinates and per-link offsets of LineStrings or WKT strings,
+    links without a geometry get no coordinates. The buffer has a z column
+    if any of the geometries has one."""
+    chunks = [np.empty((0, 2))] * len(geometries)
+    wkt, wkt_index = [], []
+    for idx, geometry in enumerate(geometries):
+        if isinstance(geometry, _LazyGeometry):
+            # coordinates straight from the loader, no shapely object needed
+            chunks[idx] = geometry.coords[geometry.start:geometry.end]
+        elif isinstance(geometry, str):
+            wkt.append(geometry)
+            wkt_index.append(idx)
+        elif geometry is not None:
+            chunks[idx] = shapely.get_coordinates(geometry, include_z=geometry.has_z)
+    if wkt:
+        parsed = shapely.from_wkt(wkt)
+        coords, index = shapely.get_coordinates(
+            parsed, include_z=bool(shapely.has_z(parsed).any()), return_index=True)
+        splits = np.cumsum(np.bincount(index, minlength=len(wkt)))[:-1]
+        for idx, chunk in zip(wkt_index, np.split(coords, splits)):
+            chunks[idx] = chunk
+    offsets = np.zeros(len(geometries) + 1, dtype=np.int64)
+    np.cumsum([len(chunk) for chunk in chunks], out=offsets[1:])
+    dims = max([chunk.shape[1] for chunk in chunks if len(chunk)] or [2])
+    buffer = np.zeros((offsets[-1], dims))
+    for idx, chunk in enumerate(chunks):
+        buffer[offsets[idx]:offsets[idx + 1], :chunk.shape[1]] = chunk
+    return offsets, buffer
+
+
+class Network(object):
+    """Road network held in flat NumPy arrays.
+
+    Nodes are rows of `node_xy`, links rows of the link arrays (`link_ids`,
+    `source`/`target` node rows, `lanes`, `length`, `roadparam`). Links
+    leaving or entering a node are kept in CSR form (`out_offsets`,
+    `out_links`, `in_offsets`, `in_links`) and link geometries in one
+    coordinate buffer, `geometry_coords[geometry_offsets[i]:geometry_offsets[i+1]]`
+    for link i. Other attributes are kept as arrays in `node_attrs` and
+    `link_attrs`, graph-level data (crs, roadparams, demands) in `graph`.
+
+        net = Network.load('UPDiliman_small.xml')
+        net.out_links_of(0)        # view into out_links
+        G = net.to_networkx()      # same layout as pyotm.scenario.load
+    """
+
+    def __init__(self, node_ids, node_xy, link_ids, source, target, lanes, length,
+                 roadparam=None, geometry_offsets=None, geometry_coords=None,
+                 node_attrs=None, link_attrs=None, graph=None):
+        self.node_ids = np.asarray(node_ids)
+        self.node_xy = np.asarray(node_xy, dtype=float).reshape(-1, 2)
+        self.link_ids = np.asarray(link_ids, dtype=np.int64)
+        self.source = np.asarray(source, dtype=np.int64)
+        self.target = np.asarray(target, dtype=np.int64)
+        self.lanes = np.asarray(lanes, dtype=np.int64)
+        self.length = np.asarray(length, dtype=float)
+        num_links = len(self.link_ids)
+        self.roadparam = np.full(num_links, -1, dtype=np.int64) if roadparam is None \
+            else np.asarray(roadparam, dtype=np.int64)
+        self.geometry_offsets = np.zeros(num_links + 1, dtype=np.int64) \
+            if geometry_offsets is None else np.asarray(geometry_offsets, dtype=np.int64)
+        self.geometry_coords = np.empty((0, 2)) if geometry_coords is None \
+            else np.asarray(geometry_coords, dtype=float)
+        self.node_attrs = dict(node_attrs or {})
+        self.link_attrs = dict(link_attrs or {})
+        self.graph = dict(graph or {})
+        self.out_offsets, self.out_links = _csr(self.source, self.num_nodes)
+        self.in_offsets, self.in_links = _csr(self.target, self.num_nodes)
+        self._node_index = None
+
+    @property
+    def num_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def num_links(self):
+        return len(self.link_ids)
+
+    @property
+    def crs(self):
+        return self.graph.get('crs')
+
+    @property
+    def nbytes(self):
+        arrays = [self.node_ids, self.node_xy, self.link_ids, self.source, self.target,
+                  self.lanes, self.length, self.roadparam, self.geometry_offsets,
+                  self.geometry_coords, self.out_offsets, self.out_links,
+                  self.in_offsets, self.in_links]
+        arrays += list(self.node_attrs.values()) + list(self.link_attrs.values())
+        return sum(array.nbytes for array in arrays)
+
+    def node_index(self, node_id):
+        """Row of a node id."""
+        if self._node_index is None:
+            self._node_index = {node: idx for idx, node in enumerate(self.node_ids.tolist())}
+        return self._node_index[node_id]
+
+    def out_links_of(self, node):
+        return self.out_links[self.out_offsets[node]:self.out_offsets[node + 1]]
+
+    def in_links_of(self, node):
+        return self.in_links[self.in_offsets[node]:self.in_offsets[node + 1]]
+
+    @property
+    def out_degree(self):
+        return np.diff(self.out_offsets)
+
+    @property
+    def in_degree(self):
+        return np.diff(self.in_offsets)
+
+    def has_geometry(self):
+        return np.diff(self.geometry_offsets) > 0
+
+    def link_coords(self, link):
+        """Coordinates of a link, its end nodes if it has no geometry."""
+        start, end = self.geometry_offsets[link], self.geometry_offsets[link + 1]
+        if end > start:
+            return self.geometry_coords[start:end, :2]
+        return self.node_xy[[self.source[link], self.target[link]]]
+
+    def lines(self):
+        """The coordinates of every link, e.g. for a LineCollection."""
+        return [self.link_coords(link) for link in range(self.num_links)]
+
+    # networkx ---------------------
+
+    @classmethod
+    def load(cls, filepath, crs=None):
+        return cls.from_networkx(scenario.load(filepath, crs=crs))
+
+    @classmethod
+    def from_networkx(cls, G):
+        """From a graph laid out like pyotm.scenario.load (link `id`,
+        `full_lanes`, `roadparam`) or like the osmnx-based generators
+        (`link_id`, `lanes`). Link attributes missing from some links are
+        filled with None."""
+        nodes = list(G.nodes(data=True))
+        edges = list(G.edges(data=True))
+        node_index = {node: idx for idx, (node, _) in enumerate(nodes)}
+        raw = [dict.items(data) for _, _, data in edges]
+
+        def column(key, default=None):
+            return [data.get(key, default) for _, _, data in edges]
+
+        if all('id' in data for _, _, data in edges):
+            link_ids = column('id')
+        elif all('link_id' in data for _, _, data in edges):
+            link_ids = column('link_id')
+        else:
+            link_ids = range(len(edges))
+        lanes = [int(float(data.get('full_lanes', data.get('lanes', 1)))) for _, _, data in edges]
+        roadparam = [int(data.get('roadparam', -1)) for _, _, data in edges]
+        geometry_offsets, geometry_coords = _geometry_buffers(
+            [dict(items).get('geometry') for items in raw])
+
+        link_keys = set(key for items in raw for key, _ in items) - set(
+            ['id', 'link_id', 'full_lanes', 'lanes', 'length', 'roadparam', 'geometry',
+             'start_node_id', 'end_node_id'])
+        node_keys = set(key for _, data in nodes for key in dict.keys(data)) - set(
+            ['id', 'x', 'y', 'geometry'])
+        return cls(
+            _ids([node for node, _ in nodes]),
+            [(float(data['x']), float(data['y'])) for _, data in nodes],
+            _ids(link_ids),
+            [node_index[u] for u, _, _ in edges], [node_index[v] for _, v, _ in edges],
+            lanes, [float(length) for length in column('length', 0.0)], roadparam,
+            geometry_offsets, geometry_coords,
+            node_attrs={key: _attribute_array(data.get(key) for _, data in nodes)
+                        for key in sorted(node_keys)},
+            link_attrs={key: _attribute_array(column(key)) for key in sorted(link_keys)},
+            graph=G.graph)
+
+    def to_networkx(self):
+        """MultiDiGraph laid out like pyotm.scenario.load, with lazily built
+        geometry."""
+        G = OTMGraph()
+        G.graph.update(self.graph)
+        node_keys = [str(node) for node in self.node_ids.tolist()]
+        node_columns = {key: values.tolist() for key, values in self.node_attrs.items()}
+        nodes = []
+        for idx, (node, (x, y)) in enumerate(zip(node_keys, self.node_xy.tolist())):
+            attrib = {key: values[idx] for key, values in node_columns.items()
+                      if values[idx] is not None}
+            attrib.update({'id': node, 'x': x, 'y': y,
+                           'geometry': _LazyGeometry(self.node_xy, idx)})
+            nodes.append((node, attrib))
+        G.add_nodes_from(nodes)
+
+        # plain lists, indexing NumPy arrays one item at a time is slow
+        link_columns = {key: values.tolist() for key, values in self.link_attrs.items()}
+        offsets = self.geometry_offsets.tolist()
+        edges = []
+        for idx, (link_id, source, target, length, lanes, roadparam) in enumerate(zip(
+                self.link_ids.tolist(), self.source.tolist(), self.target.tolist(),
+                self.length.tolist(), self.lanes.tolist(), self.roadparam.tolist())):
+            attrib = {key: values[idx] for key, values in link_columns.items()
+                      if values[idx] is not None}
+            u, v = node_keys[source], node_keys[target]
+            attrib.update({'id': str(link_id), 'length': length, 'full_lanes': lanes,
+                           'start_node_id': u, 'end_node_id': v})
+            if roadparam >= 0:
+                attrib['roadparam'] = str(roadparam)
+            if offsets[idx + 1] > offsets[idx]:
+                attrib['geometry'] = _LazyGeometry(self.geometry_coords, offsets[idx],
+                                                   offsets[idx + 1])
+            edges.append((u, v, attrib))
+        G.add_edges_from(edges)
+        return G
+
+    # igraph ---------------------
+
+    @classmethod
+    def from_igraph(cls, graph):
+        """From an igraph graph as read by pyotm.writer (vertex `x`/`y`, edge
+        `length`, `lanes` and WKT `geometry`). Vertex and edge indices
+        become the node and link ids."""
+        link_keys = [key for key in graph.es.attributes() if key not in
+                     ('length', 'lanes', 'geometry', 'roadparam')]
+        node_keys = [key for key in graph.vs.attributes() if key not in ('x', 'y', 'geometry')]
+        geometry = graph.es['geometry'] if 'geometry' in graph.es.attributes() \
+            else [None] * graph.ecount()
+        geometry_offsets, geometry_coords = _geometry_buffers(geometry)
+        edges = np.array(graph.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+        roadparam = graph.es['roadparam'] if 'roadparam' in graph.es.attributes() else None
+        return cls(
+            np.arange(graph.vcount()),
+            np.column_stack([np.array(graph.vs['x'], dtype=float),
+                             np.array(graph.vs['y'], dtype=float)]) if graph.vcount() else [],
+            np.arange(graph.ecount()), edges[:, 0], edges[:, 1],
+            [int(float(lanes)) for lanes in graph.es['lanes']],
+            np.array(graph.es['length'], dtype=float), roadparam,
+            geometry_offsets, geometry_coords,
+            node_attrs={key: _attribute_array(graph.vs[key]) for key in node_keys},
+            link_attrs={key: _attribute_array(graph.es[key]) for key in link_keys},
+            graph={key: graph[key] for key in graph.attributes()})
+
+    def to_igraph(self):
+        """igraph graph with vertex and edge indices following the node and
+        link rows, attributes as expected by pyotm.writer.OTM_Model."""
+        import igraph
+        graph = igraph.Graph(n=self.num_nodes, directed=True,
+                             edges=np.column_stack([self.source, self.target]).tolist())
+        for key, value in self.graph.items():
+            if isinstance(value, (str, int, float)):
+                graph[key] = value
+        graph.vs['x'] = self.node_xy[:, 0].tolist()
+        graph.vs['y'] = self.node_xy[:, 1].tolist()
+        for key, values in self.node_attrs.items():
+            graph.vs[key] = values.tolist()
+        graph.es['length'] = self.length.tolist()
+        graph.es['lanes'] = self.lanes.tolist()
+        if np.any(self.roadparam >= 0):
+            graph.es['roadparam'] = self.roadparam.tolist()
+        for key, values in self.link_attrs.items():
+            graph.es[key] = values.tolist()
+        if self.num_links:
+            geometries = shapely.linestrings(
+                np.concatenate(self.lines()),
+                indices=np.repeat(np.arange(self.num_links),
+                                  [len(line) for line in self.lines()]))
+            graph.es['geometry'] = shapely.to_wkt(geometries, rounding_precision=-1).tolist()
+        return graph
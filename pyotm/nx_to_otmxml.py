@@ -2,14 +2,11 @@ from itertools import product
 import networkx as nx
 import numpy as np
 from collections import OrderedDict
+import sys
 
-from xml.etree.ElementTree import Element, SubElement, tostring
-import xml.dom.minidom
+from lxml.etree import Element, SubElement
 
-def pretty_tostring(xml_data):
-    xml_data = xml.dom.minidom.parseString(tostring(xml_data))
-    xml_pretty_str = xml_data.toprettyxml(indent="  ")
-    return xml_pretty_str
+from pyotm.xmlstream import Section, write_xml
 
 
 graph = nx.DiGraph()
@@ -72,117 +69,134 @@ for node in graph.nodes:
     graph.nodes[node]['splits_set'] = splits_set
 
 
-# Base XML data
-scenario = Element("scenario")
-network = SubElement(scenario, "network")
+# Base XML data, each section is generated while it is written
 
 # Generate node list
-node_set = SubElement(network, "nodes")
-for node in graph.nodes:
-    node_id = SubElement(node_set, "node", {"id": str(node)})
+def iter_nodes():
+    for node in graph.nodes:
+        yield Element("node", {"id": str(node)})
 
 # Generate edge list
-link_set = SubElement(network, "links")
-sorted_links = sorted([[graph.edges[i]['link_id'], i, graph.edges[i]] for i in graph.edges], key=lambda x: x[0])
-for link_id, node_pair, link_attr in sorted_links:
-    edge_id = SubElement(link_set, "link", {
-        "id": str(link_id), "length": str(100.0),
-        "full_lanes": str(4), "start_node_id": str(node_pair[0]),
-        "end_node_id": str(node_pair[1]), "roadparam": "0"
-    })
+def iter_links():
+    sorted_links = sorted([[graph.edges[i]['link_id'], i, graph.edges[i]] for i in graph.edges], key=lambda x: x[0])
+    for link_id, node_pair, link_attr in sorted_links:
+        yield Element("link", {
+            "id": str(link_id), "length": str(100.0),
+            "full_lanes": str(4), "start_node_id": str(node_pair[0]),
+            "end_node_id": str(node_pair[1]), "roadparam": "0"
+        })
 
 # Generate RC list 
-roadconnections = SubElement(network, "roadconnections")
-for node in graph.nodes:
-    for rc_data in graph.nodes[node]['node_rcs']:
-        rc = SubElement(roadconnections, "roadconnection", {
-            "id": str(rc_data['rc_id']),
-            "in_link": str(rc_data['link_id_pair'][0]),
-            "out_link": str(rc_data['link_id_pair'][1]),
-            "in_link_lanes": "1#1",
-            "out_link_lanes": "1#1"
-        })
-        
-roadparams = SubElement(network, "roadparams")
-roadparam = SubElement(roadparams, "roadparam", {
+def iter_roadconnections():
+    for node in graph.nodes:
+        for rc_data in graph.nodes[node]['node_rcs']:
+            yield Element("roadconnection", {
+                "id": str(rc_data['rc_id']),
+                "in_link": str(rc_data['link_id_pair'][0]),
+                "out_link": str(rc_data['link_id_pair'][1]),
+                "in_link_lanes": "1#1",
+                "out_link_lanes": "1#1"
+            })
+
+roadparam = Element("roadparam", {
     "id": "0", "name": "link type 0", "speed": str(20.0), "capacity": str(2500), "jam_density": str(608.3333)
 })
 
+network = Section("network", lambda: [
+    Section("nodes", iter_nodes),
+    Section("links", iter_links),
+    Section("roadconnections", iter_roadconnections),
+    Section("roadparams", lambda: [roadparam])])
+
 
 ## SPLITS DATA
 
-splits = SubElement(scenario, "splits")
-for node in graph.nodes:
-    for split_data in graph.nodes[node]['splits_set']:
-        split_node = SubElement(splits, "split_node", {
-            "node_id": str(node), "commodity_id": str(0), "link_in": str(split_data['link_in'])
-        })
-#         print(list(zip(split_data['link_out'], split_data['split_ratio'])))
-        for link_out, ratio in zip(split_data['link_out'], split_data['split_ratio']):
-            split = SubElement(split_node, "split", {"link_out": str(link_out) })
-            split.text = str(ratio)
+def iter_splits():
+    for node in graph.nodes:
+        for split_data in graph.nodes[node]['splits_set']:
+            split_node = Element("split_node", {
+                "node_id": str(node), "commodity_id": str(0), "link_in": str(split_data['link_in'])
+            })
+    #         print(list(zip(split_data['link_out'], split_data['split_ratio'])))
+            for link_out, ratio in zip(split_data['link_out'], split_data['split_ratio']):
+                split = SubElement(split_node, "split", {"link_out": str(link_out) })
+                split.text = str(ratio)
+            yield split_node
 
             
 # SUBNETWORK DATA
-subnetworks = SubElement(scenario, "subnetworks")
-# zip all edge ids to their respective subnetwork ids
-subnet_pairs = [(graph.edges[edge]['link_id'],graph.edges[edge]['subnetwork_id']) for edge in graph.edges]
-distinct_subnets = set(list(zip(*subnet_pairs))[1])
+def iter_subnetworks():
+    # zip all edge ids to their respective subnetwork ids
+    subnet_pairs = [(graph.edges[edge]['link_id'],graph.edges[edge]['subnetwork_id']) for edge in graph.edges]
+    distinct_subnets = set(list(zip(*subnet_pairs))[1])
 
-for subnet_id in distinct_subnets:
-    subnet_links = sorted([i[0] for i in subnet_pairs if i[1] == subnet_id])
-    subnetwork = SubElement(subnetworks, "subnetwork", {"id": str(subnet_id)})
-    subnetwork.text = ",".join([str(i) for i in subnet_links])
+    for subnet_id in distinct_subnets:
+        subnet_links = sorted([i[0] for i in subnet_pairs if i[1] == subnet_id])
+        subnetwork = Element("subnetwork", {"id": str(subnet_id)})
+        subnetwork.text = ",".join([str(i) for i in subnet_links])
+        yield subnetwork
 
     
 # SENSOR DATA
-sensors = SubElement(scenario, "sensors")
-for edge in graph.edges:
-    edge_attr = graph.edges[edge]
-    sensor = SubElement(sensors, "sensor", {
-        "id": str(edge_attr['link_id']), "type": "fixed", "dt": "2", "link_id": str(edge_attr['link_id'])
-    })
+def iter_sensors():
+    for edge in graph.edges:
+        edge_attr = graph.edges[edge]
+        yield Element("sensor", {
+            "id": str(edge_attr['link_id']), "type": "fixed", "dt": "2", "link_id": str(edge_attr['link_id'])
+        })
 
 
 # AUXILLIARY DATA
 
-plugins = SubElement(scenario, "plugins")
-plugin = SubElement(plugins, "plugin", {
+plugin = Element("plugin", {
     "name": "linkpressure", "folder": "", "class": "ControllerSignalPretimedInternal"
 })
 
-models = SubElement(scenario, "models")
-model = SubElement(models, "model", {
+model = Element("model", {
     "type": "point_queue", "name": "my_model", "is_default": "true"
 })
 model_params = SubElement(model, "model_params", {
     "max_cell_length": "20", "sim_dt": "2"
 })
 
-commodities = SubElement(scenario, "commodities")
-commodity = SubElement(commodities, "commodity", {"id": "0", "name": "car", "subnetworks": "1"})
-
-demands = SubElement(scenario, "demands")
-for source_link_id in [30, 32]:
-    demand = SubElement(demands, "demand", {
-        "commodity_id": "0", "subnetwork": "1", "start_time": "0", "link_id": str(source_link_id), "dt": "28000"
-    })
-    demand.text = ",".join([str(i) for i in [600]])
+commodity = Element("commodity", {"id": "0", "name": "car", "subnetworks": "1"})
 
+def iter_demands():
+    for source_link_id in [30, 32]:
+        demand = Element("demand", {
+            "commodity_id": "0", "subnetwork": "1", "start_time": "0", "link_id": str(source_link_id), "dt": "28000"
+        })
+        demand.text = ",".join([str(i) for i in [600]])
+        yield demand
 
-controllers = SubElement(scenario, "controllers")
-controller = SubElement(controllers, "controller", {"id": "0", "type": "linkpressure", "dt": "2.0"})
 
-feedback_sensors = SubElement(controller, "feedback_sensors")
-for edge in graph.edges:
-    edge_id = graph.edges[edge]['link_id']
-    SubElement(feedback_sensors, "feedback_sensor", {"id": str(edge_id), "usage": str(edge_id)})
+def iter_feedback_sensors():
+    for edge in graph.edges:
+        edge_id = graph.edges[edge]['link_id']
+        yield Element("feedback_sensor", {"id": str(edge_id), "usage": str(edge_id)})
 
-target_actuators = SubElement(controller, "target_actuators")
-for actuator_id in [0, 1]:
-    target_actuator = SubElement(target_actuators, "target_actuator", {
-        "id": str(actuator_id), "usage": str(actuator_id)
-    })
+def iter_target_actuators():
+    for actuator_id in [0, 1]:
+        yield Element("target_actuator", {
+            "id": str(actuator_id), "usage": str(actuator_id)
+        })
 
-with open("otm_netgen.xml", "wt") as xml_file:
-    xml_file.write(pretty_tostring(scenario))
+controller = Section("controller", lambda: [
+    Section("feedback_sensors", iter_feedback_sensors),
+    Section("target_actuators", iter_target_actuators)],
+    {"id": "0", "type": "linkpressure", "dt": "2.0"})
+
+scenario = Section("scenario", lambda: [
+    network,
+    Section("splits", iter_splits),
+    Section("subnetworks", iter_subnetworks),
+    Section("sensors", iter_sensors),
+    Section("plugins", lambda: [plugin]),
+    Section("models", lambda: [model]),
+    Section("commodities", lambda: [commodity]),
+    Section("demands", iter_demands),
+    Section("controllers", lambda: [controller])])
+
+# an .xml.gz or .xml.zst name writes a compressed scenario
+output_file = sys.argv[1] if len(sys.argv) > 1 else "otm_netgen.xml"
+write_xml(output_file, scenario, pretty_print=True)
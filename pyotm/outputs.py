@@ -0,0 +1,131 @@
+#!/usr/bin/env/python
+from collections import namedtuple
+import numpy as np
+import json
+
+from pyotm.profiling import PhaseTimer
+
+
+class LinkSeries(object):
+    """Link x time block of samples, indexed by link id (or lanegroup,
+    path or subnetwork id for those outputs).
+
+    Behaves like the dict of lists returned by the JSON path (`keys`,
+    `values`, `items`, `series[link_id]`) while keeping all the samples in
+    a single 2-D array, `array`, whose rows follow `link_ids`."""
+
+    def __init__(self, link_ids, values):
+        self.link_ids = np.asarray(link_ids, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        self.array = values.reshape(len(self.link_ids), -1) \
+            if len(self.link_ids) else values.reshape(0, 0)
+        self._index = {link_id: row for row, link_id in
+                       enumerate(self.link_ids.tolist())}
+
+    def __getitem__(self, link_id):
+        # int() also accepts the stringified keys of the JSON output
+        return self.array[self._index[int(link_id)]]
+
+    def __contains__(self, link_id):
+        return int(link_id) in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self.link_ids)
+
+    def keys(self):
+        return self._index.keys()
+
+    def values(self):
+        return iter(self.array)
+
+    def items(self):
+        return zip(self._index.keys(), self.array)
+
+    def to_dict(self):
+        return {str(link_id): row.tolist() for link_id, row in self.items()}
+
+
+def unpack_link_ids(buffer):
+    return np.frombuffer(buffer, dtype='<i8')
+
+
+def unpack_link_values(buffer, link_ids):
+    return LinkSeries(link_ids, np.frombuffer(buffer, dtype='<f8'))
+
+
+def fetch_link_outputs(entry_point, binary=True, timer=None):
+    """Collects the link vehicle and flow outputs from an EntryPointOTM.
+
+    The binary path transfers each output as one packed byte block; the
+    JSON path is kept as a fallback and returns dicts of lists keyed by
+    the stringified link ids."""
+    if not binary:
+        timer = timer or PhaseTimer()
+        # JSON generation in the JVM is not separated from the transfer
+        with timer.phase('extract'):
+            link_veh, link_flw = entry_point.generateLinkVeh(), entry_point.generateLinkFlow()
+        with timer.phase('decode'):
+            return {'link_veh': json.loads(link_veh), 'link_flw': json.loads(link_flw)}
+    link_ids = unpack_link_ids(entry_point.generateLinkIdsBytes())
+    return {
+        'link_veh': unpack_link_values(entry_point.generateLinkVehBytes(), link_ids),
+        'link_flw': unpack_link_values(entry_point.generateLinkFlowBytes(), link_ids)
+    }
+
+
+# One series to record during a run. `kind` is one of OUTPUT_KINDS; `ids`
+# restricts link/lanegroup outputs to a subset, `subnetwork` selects the
+# links of a subnetwork (or the path/subnetwork for path_travel_time and
+# subnetwork_vht) and `sample_dt` overrides the runner's sampling interval.
+# Results are keyed by `name`, which defaults to `kind`.
+OutputRequest = namedtuple('OutputRequest', ['kind', 'ids', 'subnetwork', 'sample_dt', 'name'])
+OutputRequest.__new__.__defaults__ = (None, None, None, None)
+
+OUTPUT_KINDS = ('link_veh', 'link_flw', 'lanegroup_veh', 'lanegroup_flw',
+                'path_travel_time', 'subnetwork_vht')
+
+DEFAULT_OUTPUTS = (OutputRequest('link_veh'), OutputRequest('link_flw'))
+
+
+def request_outputs(entry_point, requests, sample_dt):
+    """Registers `requests` with an EntryPointOTM, returns (name, index)
+    handles for `fetch_outputs`."""
+    handles = []
+    for request in requests:
+        if request.kind not in OUTPUT_KINDS:
+            raise ValueError("Unknown output type: %s" % (request.kind,))
+        ids = np.asarray(request.ids if request.ids is not None else [], dtype='<i8')
+        subnetwork = -1 if request.subnetwork is None else int(request.subnetwork)
+        index = entry_point.requestOutput(
+            request.kind, ids.tobytes(), subnetwork,
+            float(request.sample_dt or sample_dt))
+        handles.append((request.name or request.kind, index))
+    return handles
+
+
+def fetch_outputs(entry_point, handles, drain=False, timer=None):
+    """Transfers the requested outputs as LinkSeries keyed by name. With
+    `drain`, only the samples recorded since the previous call are
+    returned and dropped on the JVM side.
+
+    A PhaseTimer gets the time spent packing in the JVM ('extract'),
+    moving the bytes through py4j ('transfer') and wrapping them
+    ('decode')."""
+    pack = entry_point.drainOutputBytes if drain else entry_point.generateOutputBytes
+    calls = PhaseTimer()
+    outputs = {}
+    for name, index in handles:
+        with calls.phase('calls'):
+            ids_buffer = entry_point.generateOutputIdsBytes(index)
+            values_buffer = pack(index)
+        with calls.phase('decode'):
+            outputs[name] = unpack_link_values(values_buffer, unpack_link_ids(ids_buffer))
+    if timer is not None:
+        packing = entry_point.takePackNanos() / 1e9
+        timer.add('extract', packing)
+        timer.add('transfer', max(calls.phases.get('calls', 0.0) - packing, 0.0))
+        timer.add('decode', calls.phases.get('decode', 0.0))
+    return outputs
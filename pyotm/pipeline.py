@@ -0,0 +1,230 @@
+#!/usr/bin/env/python
+"""Staged, cached scenario builds.
+
+A scenario is built in stages (network -> roadparams -> connections,
+splits, demands -> control) and written as groups of top-level sections.
+Each stage is keyed by a hash of its own inputs and the keys of the
+stages it is built from, and each written group is kept as a rendered
+Fragment under the keys of its stages. Changing an input only rebuilds
+the stages downstream of it and only re-renders the groups those stages
+feed; everything else is copied as it is.
+
+    pipeline = ScenarioPipeline('test2by2.graphml')
+    pipeline.set_demands(0, [100, 6000]*20, 600)
+    pipeline.write('scenario.xml')
+    pipeline.set_demands(0, [200, 6000]*20, 600)
+    pipeline.write('scenario.xml')      # only the demands are rebuilt
+
+The output is that of writer.OTM_Model. Fragments are kept in memory, or
+in a cache.ScenarioCache to be reused across sessions.
+"""
+from collections import OrderedDict
+import hashlib
+import json
+
+import numpy as np
+from igraph import read
+
+from pyotm.cache import file_hash
+from pyotm.network import Network
+from pyotm.writer import OTM_Model, link_types_of
+from pyotm.xmlstream import Section, Fragment, INDENT, render, write_xml
+
+
+# Bump whenever the scenario written for the same inputs changes
+PIPELINE_VERSION = 1
+
+# stage: stages it is built from
+STAGES = OrderedDict([
+    ('network', ()),
+    ('roadparams', ('network',)),
+    ('connections', ('network',)),
+    ('splits', ('network',)),
+    ('demands', ('network',)),
+    ('control', ('connections',)),
+])
+
+# groups of top-level sections in the order written, with the stages each
+# is rendered from
+GROUPS = OrderedDict([
+    ('network', ('roadparams', 'connections')),     # nodes, links, roadparams, roadconnections
+    ('splits', ('splits',)),
+    ('demands', ('demands',)),                      # subnetworks and demands
+    ('control', ('control',)),                      # actuators, sensors, controllers, plugins
+    ('models', ()),                                 # models and commodities
+])
+
+
+def graph_hash(graph):
+    """Hash of the structure and attributes of an igraph graph."""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(str(graph.vcount()).encode())
+    digest.update(np.array(graph.get_edgelist(), dtype=np.int64).tobytes())
+    for sequence in (graph.vs, graph.es):
+        for name in sorted(sequence.attributes()):
+            digest.update(name.encode())
+            digest.update(repr(sequence[name]).encode())
+    return digest.hexdigest()
+
+
+def _downstream(stage):
+    stages = set([stage])
+    for name, depends in STAGES.items():
+        if stages.intersection(depends):
+            stages.add(name)
+    return stages
+
+
+class ScenarioPipeline(object):
+    """Scenario of `network` (a graphml path, an igraph graph or a pyotm
+    Network) built in cached stages. Inputs are changed with the set_*
+    methods and `write` rebuilds what they affect; `rebuilt` and
+    `rendered` list the stages and groups built by the last write.
+
+    With a ScenarioCache as `cache` the rendered groups are stored on disk
+    next to the cached networks, so a new session only renders what is
+    not there yet."""
+
+    def __init__(self, network, cache=None):
+        self.cache = cache
+        self.params = {stage: None for stage in STAGES}
+        self.params['control'] = {'enabled': True}
+        self.rebuilt = []
+        self.rendered = []
+        self._keys = {}
+        self._values = {}
+        self._fragments = {}
+        self.set_network(network)
+
+    # inputs ---------------------
+
+    def _set(self, stage, params):
+        self.params[stage] = params
+        for name in _downstream(stage):
+            self._keys.pop(name, None)
+            self._values.pop(name, None)
+
+    def set_network(self, network):
+        if isinstance(network, Network):
+            network = network.to_igraph()
+        self._source = network
+        self._set('network', file_hash(network) if isinstance(network, str)
+                  else graph_hash(network))
+
+    def set_splits(self, ratios=None):
+        """{(node id, in link id): {out link id: ratio}} replacing the even
+        splits at those nodes, see OTM_Model.iter_splits."""
+        self._set('splits', sorted([int(node), int(link_in), sorted(
+            [int(link_out), float(ratio)] for link_out, ratio in node_ratios.items())]
+            for (node, link_in), node_ratios in (ratios or {}).items()))
+
+    def set_demands(self, source_node, demand_ts, demand_dt):
+        """Same arguments as OTM_Model.add_demands."""
+        self._set('demands', [source_node, list(demand_ts), demand_dt])
+
+    def set_control(self, enabled=True):
+        """Without control no actuators, sensors, controllers or plugins
+        are written."""
+        self._set('control', {'enabled': bool(enabled)})
+
+    # stages ---------------------
+
+    def key(self, stage):
+        if stage not in self._keys:
+            digest = hashlib.blake2b(digest_size=20)
+            digest.update(json.dumps([PIPELINE_VERSION, stage, self.params[stage]],
+                                     default=str).encode())
+            for depend in STAGES[stage]:
+                digest.update(self.key(depend).encode())
+            self._keys[stage] = digest.hexdigest()
+        return self._keys[stage]
+
+    def stage(self, name):
+        """Output of stage `name`, built if it is not known yet."""
+        if name not in self._values:
+            self._values[name] = getattr(self, '_build_' + name)()
+            self.rebuilt.append(name)
+        return self._values[name]
+
+    def _build_network(self):
+        if isinstance(self._source, str):
+            return read(self._source)
+        return self._source
+
+    def _build_roadparams(self):
+        return link_types_of(self.stage('network'))
+
+    def _build_connections(self):
+        graph = self.stage('network')
+        return OTM_Model(graph, with_network=False).connection_map(graph)
+
+    def _build_splits(self):
+        return {(node, link_in): dict(node_ratios) for node, link_in, node_ratios in
+                self.params['splits'] or []}
+
+    def _build_demands(self):
+        return self.params['demands']
+
+    def _build_control(self):
+        return self.params['control']
+
+    # groups ---------------------
+
+    def group_key(self, group, pretty_print=True):
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(json.dumps([PIPELINE_VERSION, group, pretty_print]).encode())
+        for stage in GROUPS[group]:
+            digest.update(self.key(stage).encode())
+        return 'fragment-' + digest.hexdigest()
+
+    def sections(self, group):
+        """Top-level sections of `group`, generated from its stages."""
+        if group in ('network', 'control'):
+            model = OTM_Model(self.stage('network'), self.stage('roadparams'),
+                              self.stage('connections'))
+            if group == 'control':
+                model.sections = []
+                model.add_controllers()
+                model.add_plugins()
+            return model.sections
+        model = OTM_Model(None if group == 'models' else self.stage('network'),
+                          with_network=False)
+        if group == 'splits':
+            model.add_splits(self.stage('splits'))
+        elif group == 'demands':
+            model.add_demands(*self.stage('demands'))
+        else:
+            model.add_model()
+        return model.sections
+
+    def fragment(self, group, pretty_print=True):
+        """`group` rendered as one Fragment, from the cache if it is there."""
+        key = self.group_key(group, pretty_print)
+        if self.cache is not None:
+            data = self.cache.load_bytes(key)
+        else:
+            cached_key, data = self._fragments.get(group, (None, None))
+            if cached_key != key:
+                data = None
+        if data is None:
+            separator = ('\n' + INDENT).encode() if pretty_print else b''
+            data = separator.join(render(section, 1, pretty_print)
+                                  for section in self.sections(group))
+            if self.cache is not None:
+                self.cache.store_bytes(key, data)
+            else:
+                self._fragments[group] = (key, data)
+            self.rendered.append(group)
+        return Fragment(data)
+
+    def write(self, filename, pretty_print=True):
+        """Writes the scenario, rebuilding only the stages and groups whose
+        inputs changed since they were last built."""
+        if self.params['demands'] is None:
+            raise ValueError("No demands, call set_demands before writing")
+        self.rebuilt = []
+        self.rendered = []
+        groups = [group for group in GROUPS
+                  if group != 'control' or self.params['control']['enabled']]
+        write_xml(filename, Section('scenario', lambda: (
+            self.fragment(group, pretty_print) for group in groups)), pretty_print)
@@ -0,0 +1,256 @@
+#!/usr/bin/env/python
+from collections import namedtuple, deque
+import multiprocessing
+import threading
+import itertools
+import traceback
+import queue
+
+from pyotm.gateway import GatewayManager
+from pyotm.runner import OTMRunner
+
+
+# A single simulation: the scenario file, {actuator_id: stage timings},
+# per-trial runner settings (simulation_time, sample_dt) and changed
+# demands/splits/roadparams, see OTMRunner.set_inputs
+Trial = namedtuple('Trial', ['scenario', 'schedules', 'settings', 'inputs'])
+Trial.__new__.__defaults__ = (None, None, None)
+
+
+class OTMWorkerError(RuntimeError):
+    def __init__(self, message, task_id=None):
+        super(OTMWorkerError, self).__init__(message)
+        # None when the pool itself failed rather than a single trial
+        self.task_id = task_id
+
+
+def _run_trial(runners, manager, trial, runner_kwargs):
+    settings = dict(runner_kwargs, **(trial.settings or {}))
+    runner = runners.get(trial.scenario)
+    if runner is None:
+        runner = runners[trial.scenario] = OTMRunner(
+            trial.scenario, gateway=manager, **settings)
+    runner.reset(**settings)
+    # inputs changed by an earlier trial on this worker are undone here
+    runner.set_inputs(trial.inputs)
+    if trial.schedules:
+        runner.insert_schedules(trial.schedules, strict=True)
+    output = runner.run()
+    return output, runner.heap
+
+
+def _needs_recycling(runs, heap, recycling):
+    max_runs = recycling.get('max_runs')
+    max_heap_fraction = recycling.get('max_heap_fraction')
+    if max_runs and runs >= max_runs:
+        return True
+    # retained heap is measured after the JVM's own collections, no forced GC
+    if max_heap_fraction and heap and heap['max'] > 0:
+        return heap['retained'] >= max_heap_fraction * heap['max']
+    return False
+
+
+def _worker_main(worker_id, tasks, results, gateway_settings, runner_kwargs, recycling):
+    # One warm JVM per worker, scenarios are loaded once and kept around
+    # until the JVM is recycled
+    manager = GatewayManager(**gateway_settings)
+    runners = {}
+    runs = 0
+    try:
+        for task_id, trial in iter(tasks.get, None):
+            output, error, heap = None, None, None
+            try:
+                output, heap = _run_trial(runners, manager, trial, runner_kwargs)
+                runs += 1
+            except Exception:
+                error = traceback.format_exc()
+            recycled = _needs_recycling(runs, heap, recycling)
+            if recycled:
+                manager.shutdown()
+                runners.clear()
+                runs = 0
+            results.put((task_id, worker_id, output, error,
+                         {'heap': heap, 'recycled': recycled}))
+    finally:
+        manager.shutdown()
+
+
+class _Worker(object):
+    def __init__(self, context, worker_id, results, gateway_settings, runner_kwargs,
+                 recycling):
+        self.tasks = context.Queue()
+        self.loaded = set()
+        self.inflight = 0
+        # task id: scenario of the trials handed to the worker, not back yet
+        self.running = {}
+        self.runs = 0
+        self.recycles = 0
+        self.heap = None
+        self.process = context.Process(
+            target=_worker_main, daemon=True,
+            args=(worker_id, self.tasks, results, gateway_settings, runner_kwargs,
+                  recycling))
+        self.process.start()
+
+
+class OTMWorkerPool(object):
+    """Pool of worker processes that each keep a JVM and their loaded
+    scenarios alive between trials.
+
+    Trials are queued here and handed to workers as they free up. A free
+    worker first takes a queued trial whose scenario it already has
+    loaded, so each scenario is parsed once per worker; a trial is only
+    sent to a cold worker when no warm one is available.
+
+    The JVM heap is read after every trial. A worker restarts its JVM
+    (dropping its loaded scenarios) after `max_runs_per_worker` trials, or
+    once the heap retained after garbage collection reaches
+    `max_heap_fraction` of the maximum heap, instead of forcing a full GC
+    after every run.
+
+        with OTMWorkerPool(8, simulation_time=3600.0) as pool:
+            outputs = pool.map([Trial('signal.xml', {4: [30.0, 30.0]})] * 64)
+    """
+
+    def __init__(self, processes=None, max_inflight=2, gateway_settings=None,
+                 max_runs_per_worker=None, max_heap_fraction=0.8, **runner_kwargs):
+        context = multiprocessing.get_context('spawn')
+        self.max_inflight = max_inflight
+        recycling = {'max_runs': max_runs_per_worker,
+                     'max_heap_fraction': max_heap_fraction}
+        self._results = context.Queue()
+        self._workers = [
+            _Worker(context, worker_id, self._results,
+                    gateway_settings or {}, runner_kwargs, recycling)
+            for worker_id in range(processes or multiprocessing.cpu_count())]
+        self._backlog = deque()
+        self._trials = {}
+        self._task_ids = itertools.count()
+        # submit/cancel may be called while another thread collects
+        self._lock = threading.RLock()
+
+    def _take_task(self, worker):
+        for idx, (task_id, trial) in enumerate(self._backlog):
+            if trial.scenario in worker.loaded:
+                del self._backlog[idx]
+                return task_id, trial
+        return None
+
+    def _dispatch(self):
+        free = [w for w in self._workers if w.inflight < self.max_inflight]
+        # Warm workers first, then whatever is left goes to the least busy
+        for worker in sorted(free, key=lambda w: w.inflight):
+            while self._backlog and worker.inflight < self.max_inflight:
+                task = self._take_task(worker)
+                if task is None:
+                    break
+                self._send(worker, task)
+        for worker in sorted(free, key=lambda w: w.inflight):
+            while self._backlog and worker.inflight < self.max_inflight:
+                self._send(worker, self._backlog.popleft())
+
+    def _send(self, worker, task):
+        worker.loaded.add(task[1].scenario)
+        worker.running[task[0]] = task[1].scenario
+        worker.inflight += 1
+        worker.tasks.put(task)
+
+    def _enqueue(self, trial):
+        task_id = next(self._task_ids)
+        self._trials[task_id] = trial
+        self._backlog.append((task_id, trial))
+        return task_id
+
+    def submit(self, trial):
+        with self._lock:
+            task_id = self._enqueue(trial)
+            self._dispatch()
+        return task_id
+
+    def submit_many(self, trials):
+        # Queue everything before dispatching so routing sees the whole batch
+        with self._lock:
+            task_ids = [self._enqueue(trial) for trial in trials]
+            self._dispatch()
+        return task_ids
+
+    def cancel(self, task_id):
+        """Drops a trial that has not been handed to a worker yet. Returns
+        False if it is already running (its result will still arrive)."""
+        with self._lock:
+            for idx, (queued_id, _) in enumerate(self._backlog):
+                if queued_id == task_id:
+                    del self._backlog[idx]
+                    del self._trials[task_id]
+                    return True
+        return False
+
+    def collect(self, timeout=None):
+        """Waits for the next finished trial, returns (task_id, output)."""
+        while True:
+            try:
+                task_id, worker_id, output, error, info = self._results.get(
+                    timeout=timeout or 1.0)
+                break
+            except queue.Empty:
+                dead = [w for w in self._workers if not w.process.is_alive()]
+                if dead:
+                    raise OTMWorkerError(
+                        "Worker process exited with code %s" % dead[0].process.exitcode)
+                if timeout is not None:
+                    raise
+        with self._lock:
+            worker = self._workers[worker_id]
+            worker.inflight -= 1
+            worker.running.pop(task_id, None)
+            worker.runs += 1
+            worker.heap = info['heap']
+            if info['recycled']:
+                worker.recycles += 1
+                # the trials still queued on the worker run on the new JVM
+                # and load their scenarios there, everything else is gone
+                worker.loaded = set(worker.running.values())
+            trial = self._trials.pop(task_id)
+            self._dispatch()
+        if error is not None:
+            raise OTMWorkerError("Trial %s failed:\n%s" % (trial, error), task_id)
+        return task_id, output
+
+    def worker_stats(self):
+        return [{'runs': w.runs, 'recycles': w.recycles, 'heap': w.heap}
+                for w in self._workers]
+
+    def imap_unordered(self, trials):
+        """Yields (trial, output) pairs in order of completion."""
+        task_ids = self.submit_many(trials)
+        submitted = {task_id: self._trials[task_id] for task_id in task_ids}
+        for _ in task_ids:
+            task_id, output = self.collect()
+            yield submitted[task_id], output
+
+    def map(self, trials):
+        task_ids = self.submit_many(trials)
+        outputs = {}
+        for _ in task_ids:
+            task_id, output = self.collect()
+            outputs[task_id] = output
+        return [outputs[task_id] for task_id in task_ids]
+
+    def close(self):
+        for worker in self._workers:
+            worker.tasks.put(None)
+        for worker in self._workers:
+            worker.process.join()
+
+    def terminate(self):
+        for worker in self._workers:
+            worker.process.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
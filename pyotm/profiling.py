@@ -0,0 +1,55 @@
+#!/usr/bin/env/python
+from contextlib import contextmanager
+from collections import OrderedDict
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+_timing_hooks = []
+
+
+class PhaseTimer(object):
+    """Accumulates wall-clock seconds per named phase, in the order the
+    phases were first entered."""
+
+    def __init__(self):
+        self.phases = OrderedDict()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def __getitem__(self, name):
+        return self.phases[name]
+
+    @property
+    def total(self):
+        return sum(self.phases.values())
+
+    def as_dict(self):
+        return dict(self.phases)
+
+
+def add_timing_hook(hook):
+    """Registers `hook(runner, timings)`, called after every run with the
+    same timings dict that is returned under the output's 'timings' key."""
+    _timing_hooks.append(hook)
+
+
+def remove_timing_hook(hook):
+    _timing_hooks.remove(hook)
+
+
+def report_timings(runner, timings, hook=None):
+    logger.debug("%s: %s", runner, timings)
+    for registered in _timing_hooks + ([hook] if hook else []):
+        registered(runner, timings)
@@ -1,46 +1,259 @@
 #!/usr/bin/env/python
-from py4j.java_gateway import JavaGateway, launch_gateway, GatewayParameters
-import matplotlib.pyplot as plt
-import multiprocessing
 import numpy as np
-import time
 import json
-import sys
-import os
 
+from pyotm.gateway import common_gateway
+from pyotm.profiling import PhaseTimer, report_timings
+from pyotm.outputs import fetch_link_outputs, request_outputs, fetch_outputs, DEFAULT_OUTPUTS
+
+
+def pack_schedules(schedules):
+    """Packs {actuator_id: stage timings} (or an (actuator_ids, timings)
+    pair, e.g. ids and a 2-D array) into the id, offset and duration blocks
+    taken by ExposedAPI.insertActuatorSchedules."""
+    if isinstance(schedules, tuple):
+        actuator_ids, timings = schedules
+    else:
+        actuator_ids, timings = list(schedules.keys()), list(schedules.values())
+    timings = [np.asarray(t, dtype='<f8').ravel() for t in timings]
+    offsets = np.zeros(len(timings) + 1, dtype='<i4')
+    np.cumsum([len(t) for t in timings], out=offsets[1:])
+    durations = np.concatenate(timings) if timings else np.zeros(0, dtype='<f8')
+    return (np.asarray(actuator_ids, dtype='<i8').tobytes(), offsets.tobytes(),
+            durations.astype('<f8').tobytes())
+
+
+def _id(value):
+    # -1 stands for "any" on the JVM side
+    return -1 if value is None else int(value)
+
+
+def _float(value):
+    # NaN leaves the field as loaded
+    return float('nan') if value is None else float(value)
+
+
+def _csv(values):
+    return ','.join(repr(value) for value in np.asarray(values, dtype=float).ravel().tolist())
 
-common_gateway = JavaGateway(gateway_parameters=GatewayParameters(
-        port=launch_gateway(
-            classpath=os.path.join(
-                os.path.dirname(__file__),
-                'data/otm-python-api-1.0-SNAPSHOT-jar-with-dependencies.jar'),
-            die_on_exit=True, redirect_stdout=sys.stdout
-        ), auto_field=True, auto_convert=True
-    ))
 
 class OTMRunner(object):
     def __init__(self, otm_xml, **kwargs):
 
-        # self.java = common_gateway.jvm.java  # allow calling JDK
-        self.entry_point = common_gateway.jvm.EntryPointOTM()
+        # JVM is started here on first use, see pyotm.gateway
+        self.gateway = kwargs.get('gateway') or common_gateway
+        # self.java = self.gateway.jvm.java  # allow calling JDK
+        self.entry_point = self.gateway.jvm.EntryPointOTM()
         self.api = self.entry_point.api
 
         self.simulation_time = float(kwargs.get('simulation_time', 2*7200.0))
         self.sample_dt = float(kwargs.get('sample_dt', 15.0))
-        self.entry_point.api.load(otm_xml, True)
+        # OutputRequests to record, see pyotm.outputs
+        self.outputs = list(kwargs.get('outputs') or DEFAULT_OUTPUTS)
+        self.current_time = None
+        self._handles = None
+        # snapshot name -> simulation time it was taken at, see warm_up
+        self._snapshots = {}
+        # JVM heap after the last run, see GatewayManager.heap_usage
+        self.heap = None
+        # Per-phase timings are returned under output['timings'] and handed
+        # to `timing_hook(runner, timings)`, see pyotm.profiling. With
+        # `profile_jvm` the JVM heap is also read before each run.
+        self.timing_hook = kwargs.get('timing_hook')
+        self.profile_jvm = kwargs.get('profile_jvm', False)
+        # The load time is reported with the first run after it
+        self._timer = PhaseTimer()
+        # .xml.gz and .xml.zst scenarios are decompressed by the JVM as it parses
+        with self._timer.phase('load'):
+            self.entry_point.api.load(otm_xml, True)
         # self.entry_point.api.set_stochastic_process("deterministic")
         # self.subnet_set = self.beats_api.get_subnetworks()
 
+    def reset(self, **kwargs):
+        # Clears inserted schedules, and hands the signals a previous run
+        # left unscheduled back to the controller, so that the loaded
+        # scenario can be rerun, optionally with different
+        # simulation_time/sample_dt/outputs
+        self.api.clearActuatorSchedules()
+        self.current_time = None
+        self.simulation_time = float(kwargs.get('simulation_time', self.simulation_time))
+        self.sample_dt = float(kwargs.get('sample_dt', self.sample_dt))
+        self.outputs = list(kwargs.get('outputs') or self.outputs)
+
     def insert_schedule(self, actuator_id, schedule_list):
+        """Adds a schedule item to those the actuator already has."""
         self.api.insertActuatorSchedule(actuator_id, schedule_list)
 
-    def run(self):
-        self.entry_point.initRequests(self.sample_dt)
+    def insert_schedules(self, schedules, strict=False, replace=True):
+        """Inserts the stage timings of many actuators in one gateway call.
+
+        Returns {actuator_id: reason} for the rejected actuators; the others
+        are inserted. With `strict`, nothing is inserted and a ValueError is
+        raised if any actuator is rejected. By default the new timings
+        replace each actuator's earlier schedule items, unlike
+        insert_schedule which adds to them; `replace=False` adds as
+        insert_schedule does."""
+        rejected = json.loads(self.api.insertActuatorSchedules(
+            *pack_schedules(schedules), not strict, bool(replace)))
+        rejected = {int(actuator_id): reason for actuator_id, reason in rejected.items()}
+        if strict and rejected:
+            raise ValueError("Rejected schedules: %s" % rejected)
+        return rejected
+
+    # Demands, splits and road parameters of the loaded scenario can be
+    # changed in the JVM between runs, without writing XML. Changes build
+    # on each other until reset_inputs and are applied when the next run
+    # (or stepwise run) starts. Snapshots keep the inputs they were taken
+    # with.
+
+    def set_demand(self, commodity_id, values, link_id=None, subnetwork=None,
+                   dt=None, start_time=None):
+        """Replaces the values (veh/hr) of the demand of `commodity_id` on
+        `link_id` or `subnetwork`, optionally with a new dt/start_time."""
+        self.api.setDemand(int(commodity_id), _id(link_id), _id(subnetwork), _csv(values),
+                           _float(dt), _float(start_time))
+
+    def set_splits(self, node_id, link_in, commodity_id, splits, dt=None, start_time=None):
+        """Replaces the split ratios {link_out: values} from `link_in` at
+        `node_id`."""
+        for link_out, values in splits.items():
+            self.api.setSplit(int(node_id), int(link_in), int(commodity_id), int(link_out),
+                              _csv(values), _float(dt), _float(start_time))
+
+    def set_roadparam(self, roadparam_id, capacity=None, speed=None, jam_density=None):
+        self.api.setRoadparam(int(roadparam_id), _float(capacity), _float(speed),
+                              _float(jam_density))
+
+    def set_link_roadparam(self, link_id, roadparam_id):
+        self.api.setLinkRoadparam(int(link_id), int(roadparam_id))
+
+    def set_inputs(self, inputs=None):
+        """Goes back to the loaded inputs and applies `inputs`:
+
+            {'demands': [{'commodity_id': 0, 'link_id': 3, 'values': [900.0]}],
+             'splits': [{'node_id': 2, 'link_in': 1, 'commodity_id': 0,
+                         'splits': {2: [0.3], 3: [0.7]}}],
+             'roadparams': {0: {'capacity': 1800.0}},
+             'link_roadparams': {5: 1}}
+        """
+        self.reset_inputs()
+        inputs = inputs or {}
+        for demand in inputs.get('demands', []):
+            self.set_demand(**demand)
+        for split in inputs.get('splits', []):
+            self.set_splits(**split)
+        for roadparam_id, values in inputs.get('roadparams', {}).items():
+            self.set_roadparam(roadparam_id, **values)
+        for link_id, roadparam_id in inputs.get('link_roadparams', {}).items():
+            self.set_link_roadparam(link_id, roadparam_id)
+
+    def reset_inputs(self):
+        self.api.resetInputs()
+
+    def _apply_inputs(self, timer):
+        # Rebuilds the simulator scenario from the changed inputs, the
+        # inserted schedules are carried over
+        if self.api.inputsChanged():
+            with timer.phase('rebuild'):
+                self.api.rebuildScenario()
+
+    def request_outputs(self):
+        self.entry_point.clearRequests()
+        self._handles = request_outputs(self.entry_point, self.outputs, self.sample_dt)
+
+    def _take_timer(self):
+        timer, self._timer = self._timer, PhaseTimer()
+        return timer
+
+    def _report(self, timer, heap_before=None):
+        timings = timer.as_dict()
+        timings['jvm'] = {'heap_before': heap_before, 'heap_after': self.heap}
+        report_timings(self, timings, self.timing_hook)
+        return timings
+
+    def run(self, binary=True):
+        timer = self._take_timer()
+        heap_before = self.gateway.heap_usage() if self.profile_jvm else None
+        self._apply_inputs(timer)
+        # The JSON fallback always records vehicles and flows on every link
+        with timer.phase('requests'):
+            if binary:
+                self.request_outputs()
+            else:
+                self.entry_point.initRequests(self.sample_dt)
         # Perform simulation
-        timer = time.time()
-        self.api.run(0.0, self.simulation_time)
-        print("Running the model took: {:.3f}".format(time.time() - timer))
-        return {
-            'link_veh': json.loads(self.entry_point.generateLinkVeh()),
-            'link_flw': json.loads(self.entry_point.generateLinkFlow())
-        }
\ No newline at end of file
+        with timer.phase('simulate'):
+            self.api.run(0.0, self.simulation_time)
+        if binary:
+            output = fetch_outputs(self.entry_point, self._handles, timer=timer)
+        else:
+            output = fetch_link_outputs(self.entry_point, binary=False, timer=timer)
+        self.heap = self.gateway.heap_usage()
+        output['timings'] = self._report(timer, heap_before)
+        return output
+
+    def start(self, start_time=0.0):
+        """Prepares a stepwise run, see `advance`."""
+        self._apply_inputs(self._timer)
+        with self._timer.phase('requests'):
+            self.request_outputs()
+        self.api.initialize(float(start_time))
+        self.current_time = float(start_time)
+
+    def advance(self, dt):
+        """Moves the simulation forward by `dt` seconds (at most up to
+        `simulation_time`) and returns the samples recorded in that interval.
+        Consumed samples are dropped on the JVM side."""
+        if self.current_time is None:
+            self.start()
+        timer = self._take_timer()
+        end_time = min(self.current_time + dt, self.simulation_time)
+        with timer.phase('simulate'):
+            self.api.advance(float(end_time - self.current_time))
+        self.current_time = end_time
+        chunk = fetch_outputs(self.entry_point, self._handles, drain=True, timer=timer)
+        chunk['time'] = end_time
+        chunk['timings'] = timer.as_dict()
+        return chunk
+
+    def iter_run(self, dt):
+        """Runs the whole simulation in `dt` second chunks, yielding the
+        output of each chunk. Stop iterating to abandon the run early."""
+        self.start()
+        while self.current_time < self.simulation_time:
+            yield self.advance(dt)
+
+    def snapshot(self, name='warmup'):
+        """Saves the state of a stepwise run in the JVM, see `fork`."""
+        self.entry_point.snapshot(name)
+        self._snapshots[name] = self.current_time
+
+    def warm_up(self, warmup_time, name='warmup'):
+        """Runs the first `warmup_time` seconds and snapshots the state.
+        Signals without a schedule are switched off when the run starts, so
+        insert the warm-up schedules first. Returns the warm-up output."""
+        self.start()
+        output = self.advance(warmup_time)
+        self.snapshot(name)
+        return output
+
+    def fork(self, schedules=None, name='warmup', strict=True):
+        """Continues from snapshot `name` to `simulation_time`, with the
+        given {actuator_id: stage timings} replacing the warm-up schedules
+        of those signals, and returns the output recorded after the
+        snapshot. Each call starts again from the same snapshot.
+
+            runner.insert_schedules(base_schedules)
+            runner.warm_up(1800.0)
+            outputs = [runner.fork(schedules) for schedules in candidates]
+        """
+        self.entry_point.restore(name)
+        self.current_time = self._snapshots[name]
+        if schedules:
+            self.insert_schedules(schedules, strict)
+            self.api.applyActuatorSchedules()
+        return self.advance(self.simulation_time - self.current_time)
+
+    def drop_snapshot(self, name='warmup'):
+        self.entry_point.dropSnapshot(name)
+        del self._snapshots[name]
@@ -1,6 +1,11 @@
+from collections.abc import ItemsView, ValuesView
 from shapely.geometry import LineString, Point
+from array import array
 from lxml import etree
 import networkx as nx
+import numpy as np
+
+from pyotm.compression import open_scenario
 
 
 def _point_getter(point):
@@ -9,19 +14,29 @@ def _point_getter(point):
     return tuple(float(point_att.get(key, 0)) for key in keys)
 
 
-def nodeparser(node):
+def _node_attrib(node):
     attrib = {key: val for key, val in node.attrib.items()}
     attrib['x'] = float(attrib['x'])
     attrib['y'] = float(attrib['y'])
-    attrib['geometry'] = Point(attrib['x'], attrib['y'])
     attrib['osmid'] = -1
     return attrib
 
 
-def egdeparser(link):
+def _link_attrib(link):
     attrib = {key: val for key, val in link.attrib.items()}
     attrib['length'] = float(attrib['length'])
     attrib['full_lanes'] = int(attrib['full_lanes'])
+    return attrib
+
+
+def nodeparser(node):
+    attrib = _node_attrib(node)
+    attrib['geometry'] = Point(attrib['x'], attrib['y'])
+    return attrib
+
+
+def egdeparser(link):
+    attrib = _link_attrib(link)
     points = link.xpath('.//point')
     if points:
         attrib['geometry'] = LineString(
@@ -29,16 +44,204 @@ def egdeparser(link):
     return attrib
 
 
+class _LazyGeometry(object):
+    """Placeholder for a node Point or link LineString, built from the
+    loader's coordinate arrays when the attribute is first read."""
+    __slots__ = ('coords', 'start', 'end')
+
+    def __init__(self, coords, start, end=None):
+        self.coords = coords
+        self.start = start
+        self.end = end
+
+    def build(self):
+        if self.end is None:
+            return Point(self.coords[self.start])
+        return LineString(self.coords[self.start:self.end])
+
+    def __repr__(self):
+        return "<lazy geometry>"
+
+
+class GeometryDict(dict):
+    """Attribute dict whose 'geometry' is only turned into a shapely object
+    on first access. Reading through it (indexing, get, items, values,
+    dict(...)) always returns the shapely object."""
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if isinstance(value, _LazyGeometry):
+            value = value.build()
+            dict.__setitem__(self, key, value)
+        return value
+
+    def __iter__(self):
+        # Defining __iter__ makes dict(d) and d2.update(d) go through
+        # keys() and __getitem__ instead of copying the raw values
+        return dict.__iter__(self)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def items(self):
+        return ItemsView(self)
+
+    def values(self):
+        return ValuesView(self)
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return dict.pop(self, key, *default)
+
+    def copy(self):
+        # the copy shares the placeholders and stays lazy
+        return type(self)(dict.items(self))
+
+    def __eq__(self, other):
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class OTMGraph(nx.MultiDiGraph):
+    """MultiDiGraph whose node and edge geometry is created lazily, see
+    GeometryDict."""
+    node_attr_dict_factory = GeometryDict
+    edge_attr_dict_factory = GeometryDict
+
+
+def _values(text):
+    return [float(value) for value in (text or "").replace("\n", "").split(",") if value.strip()]
+
+
+def _profile(element):
+    # Time series as used by demands and splits, `dt` of 0 means constant
+    attrib = element.attrib
+    return {'start_time': float(attrib.get('start_time', 0)),
+            'dt': float(attrib.get('dt', 0)),
+            'values': _values(element.text)}
+
+
+def roadparamparser(roadparam):
+    attrib = {key: val for key, val in roadparam.attrib.items()}
+    for key in ['capacity', 'speed', 'jam_density']:
+        attrib[key] = float(attrib[key])
+    return attrib
+
+
+def demandparser(demand):
+    attrib = _profile(demand)
+    attrib['commodity_id'] = demand.attrib.get('commodity_id')
+    attrib['link_id'] = demand.attrib.get('link_id')
+    attrib['subnetwork'] = demand.attrib.get('subnetwork')
+    return attrib
+
+
+def splitparser(split_node):
+    attrib = {key: val for key, val in split_node.attrib.items()}
+    attrib['splits'] = {split.attrib['link_out']: _profile(split)
+                        for split in split_node.xpath('./split')}
+    for profile in attrib['splits'].values():
+        profile.update({key: float(split_node.attrib[key]) for key in ['start_time', 'dt']
+                        if key in split_node.attrib})
+    return attrib
+
+
+def _subnetworkparser(subnetwork):
+    return [link_id.strip() for link_id in (subnetwork.text or "").split(",") if link_id.strip()]
+
+
+# Elements read by load, everything else is skipped
+_SCENARIO_TAGS = ('node', 'link', 'roadparam', 'model_params', 'demand', 'split_node',
+                  'subnetwork', 'roadconnection', 'commodity')
+
+
+def _release(element):
+    # Drop the element and the already processed siblings before it so the
+    # tree never holds more than the element being read
+    element.clear()
+    parent = element.getparent()
+    while element.getprevious() is not None:
+        del parent[0]
+
+
 def load(filepath, crs=None):
-    doc = etree.parse(filepath)
-    nodes = doc.xpath("//node")
-    edges = doc.xpath("//link")
-    G = nx.MultiDiGraph()
-    G.add_nodes_from([(node.attrib["id"], nodeparser(node)) for node in nodes])
-    G.add_edges_from([(edge.attrib["start_node_id"], edge.attrib["end_node_id"],
-                       egdeparser(edge)) for edge in edges])
+    """Reads an OTM scenario into a MultiDiGraph of nodes and links.
+
+    The file is read incrementally and each element is freed once read;
+    .xml.gz and .xml.zst files are decompressed on the fly.
+    Coordinates are kept in arrays and the shapely `geometry` of a node or
+    link is only created when it is first accessed (see OTMGraph).
+
+    The simulation inputs are kept in `G.graph`: 'roadparams' by id,
+    'model_params' (sim_dt, max_cell_length), 'demands' and 'splits' as
+    lists of profiles, 'subnetworks' as {id: [link ids]}, 'roadconnections'
+    as (in_link, out_link) pairs and 'commodities' by id.
+
+    For repeated loads of the same file, pyotm.cache.ScenarioCache's
+    load_network skips both the parse and building the graph."""
+    nodes, edges = [], []
+    node_coords, link_coords = array('d'), array('d')
+    link_points = []
+    graph = {'roadparams': {}, 'model_params': None, 'demands': [], 'splits': [],
+             'subnetworks': {}, 'roadconnections': [], 'commodities': {}}
+
+    with open_scenario(filepath) as source:
+        for _, element in etree.iterparse(source, events=('end',), tag=_SCENARIO_TAGS):
+            tag = element.tag
+            if tag == 'node':
+                attrib = _node_attrib(element)
+                attrib['geometry'] = len(nodes)
+                node_coords.extend((attrib['x'], attrib['y']))
+                nodes.append((attrib['id'], attrib))
+            elif tag == 'link':
+                attrib = _link_attrib(element)
+                start = len(link_coords) // 3
+                for point in element.iter('point'):
+                    link_coords.extend(_point_getter(point))
+                if len(link_coords) // 3 > start:
+                    link_points.append((attrib, start, len(link_coords) // 3))
+                edges.append((attrib['start_node_id'], attrib['end_node_id'], attrib))
+            elif tag == 'roadparam':
+                graph['roadparams'][element.attrib['id']] = roadparamparser(element)
+            elif tag == 'model_params':
+                if graph['model_params'] is None and element.getparent().tag == 'model':
+                    graph['model_params'] = {key: float(val) for key, val in element.attrib.items()}
+            elif tag == 'demand':
+                graph['demands'].append(demandparser(element))
+            elif tag == 'split_node':
+                graph['splits'].append(splitparser(element))
+            elif tag == 'subnetwork':
+                graph['subnetworks'][element.attrib['id']] = _subnetworkparser(element)
+            elif tag == 'roadconnection':
+                if 'in_link' in element.attrib and 'out_link' in element.attrib:
+                    graph['roadconnections'].append(
+                        (element.attrib['in_link'], element.attrib['out_link']))
+            elif tag == 'commodity':
+                graph['commodities'][element.attrib['id']] = dict(element.attrib)
+            _release(element)
+
+    node_coords = np.frombuffer(node_coords, dtype=float).reshape(-1, 2)
+    link_coords = np.frombuffer(link_coords, dtype=float).reshape(-1, 3)
+    for _, attrib in nodes:
+        attrib['geometry'] = _LazyGeometry(node_coords, attrib['geometry'])
+    for attrib, start, end in link_points:
+        attrib['geometry'] = _LazyGeometry(link_coords, start, end)
+
+    G = OTMGraph()
+    G.add_nodes_from(nodes)
+    G.add_edges_from(edges)
     G.graph['crs'] = crs
     G.graph['name'] = filepath
+    graph['model_params'] = graph['model_params'] or {}
+    G.graph.update(graph)
     return G
 
 
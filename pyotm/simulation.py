@@ -5,20 +5,24 @@ import numpy as np
 import sys
 
 from pyotm.runner import OTMRunner
+from pyotm.pool import OTMWorkerPool, Trial
+from pyotm.sweep import run_replicates
 
 def runner_instance(arg):
     beats = OTMRunner(arg)
     output = beats.run()
     return output
 
-def run_multiprocess(ntrials, procs=multiprocessing.cpu_count()):
-    ## TODO: using multiprocessing is currently not friendly with
-    ## the Java garbage collector (steadily increases with the
-    ## number of runs done with the process).
-    multiprocessing.set_start_method('spawn')
-    with multiprocessing.Pool(10) as workpool:
-        output_set = workpool.map(runner_instance, [sys.argv[1]] * 1024)
-    return output_set
+def run_multiprocess(ntrials, procs=multiprocessing.cpu_count(), stopping=None):
+    ## The JVM heap steadily increases with the number of runs done
+    ## within a process, the pool recycles a worker's JVM once its
+    ## retained heap gets close to the maximum (see OTMWorkerPool).
+    # Runs are folded into the statistics as they finish, memory does
+    # not grow with the number of runs. With a StoppingRule, at most
+    # ntrials are run in batches until the confidence intervals converge.
+    with OTMWorkerPool(procs) as workpool:
+        return run_replicates(workpool, lambda seed: Trial(sys.argv[1]), ntrials,
+                              stopping=stopping, batch_size=procs)
 
 
 if __name__ == "__main__":
@@ -27,10 +31,8 @@ if __name__ == "__main__":
     output = beats.run()
 
     # Multiprocess
-    # output_set = run_multiprocess(300)
-
-    # for i in output['link_flw'].keys():
-    #     output['link_flw'][i] = np.mean([k['link_flw'][i] for k in output_set], axis=0)
+    # stats = run_multiprocess(300)
+    # output['link_flw'] = stats.mean('link_flw')
 
     # sum_list = []
     # for out in output_set:
@@ -0,0 +1,164 @@
+#!/usr/bin/env/python
+from numpy.lib.format import open_memmap
+import numpy as np
+import hashlib
+import json
+import os
+
+from pyotm.outputs import LinkSeries
+
+
+STORE_VERSION = 1
+
+
+def scenario_hash(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as scenario_file:
+        for block in iter(lambda: scenario_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResultStore(object):
+    """Directory of dense, memory-mappable simulation outputs.
+
+    Each output name (link_veh, link_flw, ...) is kept in fixed-size
+    chunks `<name>/chunk_NNNNN.npy` of shape links x runs x times, so
+    appending a run writes one contiguous block per link and slicing a
+    link across all runs reads one contiguous block per chunk. Run
+    parameters and seeds go to `runs.jsonl`, store-wide information
+    (scenario hash, link ids, dtype) to `metadata.json`.
+
+        store = ResultStore.create('sweep_results', scenario='signal.xml')
+        for trial, output in pool.imap_unordered(trials):
+            store.append(output, params={'factor': 0.3}, seed=0)
+
+        flows = ResultStore('sweep_results').link('link_flw', 24)  # runs x times
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'metadata.json'), 'rt') as metadata_file:
+            self.metadata = json.load(metadata_file)
+        self.dtype = np.dtype(self.metadata['dtype'])
+        self.chunk_size = self.metadata['chunk_size']
+        self._link_index = {
+            name: {link_id: row for row, link_id in enumerate(info['link_ids'])}
+            for name, info in self.metadata['outputs'].items()}
+        self._chunks = {}
+
+    @classmethod
+    def create(cls, path, scenario=None, dtype='float32', chunk_size=64, metadata=None):
+        os.makedirs(path)
+        store_metadata = {
+            'version': STORE_VERSION,
+            'scenario': scenario,
+            'scenario_hash': scenario_hash(scenario) if scenario else None,
+            'dtype': np.dtype(dtype).str,
+            'chunk_size': int(chunk_size),
+            'num_runs': 0,
+            'outputs': {},
+            'user': metadata or {}
+        }
+        cls._write_json(os.path.join(path, 'metadata.json'), store_metadata)
+        open(os.path.join(path, 'runs.jsonl'), 'wt').close()
+        return cls(path)
+
+    @staticmethod
+    def _write_json(filepath, data):
+        # write-and-rename so a crash never leaves half a metadata file
+        with open(filepath + '.tmp', 'wt') as json_file:
+            json.dump(data, json_file)
+        os.replace(filepath + '.tmp', filepath)
+
+    def __len__(self):
+        return self.metadata['num_runs']
+
+    @property
+    def names(self):
+        return list(self.metadata['outputs'])
+
+    def _chunk_path(self, name, chunk):
+        return os.path.join(self.path, name, 'chunk_%05d.npy' % chunk)
+
+    def _chunk(self, name, chunk, mode='r'):
+        key = (name, chunk)
+        if key not in self._chunks or (mode != 'r' and self._chunks[key].mode == 'r'):
+            self._chunks[key] = open_memmap(self._chunk_path(name, chunk), mode=mode)
+        return self._chunks[key]
+
+    def _new_chunk(self, name, chunk):
+        info = self.metadata['outputs'][name]
+        shape = (len(info['link_ids']), self.chunk_size, info['num_times'])
+        self._chunks[(name, chunk)] = open_memmap(
+            self._chunk_path(name, chunk), mode='w+', dtype=self.dtype, shape=shape)
+        return self._chunks[(name, chunk)]
+
+    def append(self, output, params=None, seed=None):
+        """Appends one run, `output` being a runner output of LinkSeries.
+        `seed` is recorded as given; OTM's own random number generator is
+        not seeded by pyotm."""
+        run = self.metadata['num_runs']
+        chunk, position = divmod(run, self.chunk_size)
+        series_of = {name: series for name, series in output.items()
+                     if isinstance(series, LinkSeries)}
+        # everything is checked before anything is written, a rejected run
+        # leaves no partial chunk behind
+        if run > 0:
+            recorded = set(self.metadata['outputs'])
+            if set(series_of) != recorded:
+                raise ValueError("Run has outputs %s, the store records %s (missing %s, extra %s)" % (
+                    sorted(series_of), sorted(recorded), sorted(recorded - set(series_of)),
+                    sorted(set(series_of) - recorded)))
+            for name, series in series_of.items():
+                info = self.metadata['outputs'][name]
+                if series.array.shape != (len(info['link_ids']), info['num_times']) or \
+                        not np.array_equal(series.link_ids, info['link_ids']):
+                    raise ValueError("Output %s does not match the shape or link order of the store" % name)
+        for name, series in series_of.items():
+            info = self.metadata['outputs'].get(name)
+            if info is None:
+                info = self.metadata['outputs'][name] = {
+                    'link_ids': series.link_ids.tolist(),
+                    'num_times': series.array.shape[1]}
+                self._link_index[name] = {link_id: row for row, link_id in
+                                          enumerate(info['link_ids'])}
+                os.makedirs(os.path.join(self.path, name))
+            block = self._new_chunk(name, chunk) if position == 0 else self._chunk(name, chunk, 'r+')
+            block[:, position, :] = series.array
+            block.flush()
+
+        with open(os.path.join(self.path, 'runs.jsonl'), 'at') as runs_file:
+            runs_file.write(json.dumps({'run': run, 'params': params, 'seed': seed}) + "\n")
+        self.metadata['num_runs'] = run + 1
+        self._write_json(os.path.join(self.path, 'metadata.json'), self.metadata)
+        return run
+
+    def runs(self):
+        with open(os.path.join(self.path, 'runs.jsonl'), 'rt') as runs_file:
+            return [json.loads(line) for line in runs_file][:len(self)]
+
+    def chunks(self, name):
+        """Yields the memory-mapped chunks of `name`, trimmed to the runs
+        written so far."""
+        num_chunks = -(-len(self) // self.chunk_size)
+        for chunk in range(num_chunks):
+            block = self._chunk(name, chunk)
+            yield block[:, :min(self.chunk_size, len(self) - chunk*self.chunk_size), :]
+
+    def link(self, name, link_id):
+        """All runs of one link as a runs x times array."""
+        row = self._link_index[name][int(link_id)]
+        return np.concatenate([block[row] for block in self.chunks(name)], axis=0)
+
+    def run(self, name, run):
+        chunk, position = divmod(run, self.chunk_size)
+        if run >= len(self):
+            raise IndexError("Run %d is not in the store" % run)
+        block = self._chunk(name, chunk)
+        return LinkSeries(self.metadata['outputs'][name]['link_ids'],
+                          np.asarray(block[:, position, :], dtype=np.float64))
+
+    def load(self, name):
+        """Reads a whole output into memory as a links x runs x times array."""
+        return np.concatenate(list(self.chunks(name)), axis=1)
@@ -0,0 +1,180 @@
+#!/usr/bin/env/python
+import itertools
+import json
+import os
+
+import numpy as np
+
+from pyotm.ensemble import EnsembleStats
+
+
+def grid(**axes):
+    """Full factorial design, one dict per combination of the axis values."""
+    names = sorted(axes)
+    return [dict(zip(names, values)) for values in
+            itertools.product(*[axes[name] for name in names])]
+
+
+def latin_hypercube(n, bounds, seed=None):
+    """`n` points sampled from {name: (low, high)} with one point per
+    stratum along each axis."""
+    rng = np.random.RandomState(seed)
+    points = [{} for _ in range(n)]
+    for name, (low, high) in sorted(bounds.items()):
+        strata = (rng.permutation(n) + rng.uniform(size=n)) / n
+        for point, value in zip(points, low + strata * (high - low)):
+            point[name] = float(value)
+    return points
+
+
+def point_key(point):
+    return json.dumps(point, sort_keys=True, default=float)
+
+
+class ParameterSweep(object):
+    """Runs `replicates` trials for every point of a design on an
+    OTMWorkerPool, checkpointing each finished point.
+
+    `make_trial(point, seed)` turns a design point into a pool Trial, e.g.
+    building the `insert_schedule` timings and runner settings from the
+    point's values. `seed` is the sweep's `seed` plus the replicate number.
+    Neither pyotm nor OTMRunner seeds the simulator's own random number
+    generator: replicates are only as reproducible as what `make_trial`
+    does with `seed` (randomized demands, timings...), and the checkpoint
+    records them as the `replicates` handed to it. Every finished point is appended to `checkpoint` as a
+    JSON line with the mean and standard deviation of each output;
+    rerunning the sweep with the same checkpoint skips those points.
+
+        sweep = ParameterSweep(grid(factor=np.arange(0.1, 0.9, 0.01)),
+                               make_trial, replicates=64,
+                               checkpoint='sweep.jsonl')
+        with OTMWorkerPool(10) as pool:
+            results = sweep.run(pool)
+
+    With a `stopping` rule (see pyotm.ensemble.StoppingRule) replicates are
+    run in batches of `batch_size` and a point stops once the rule is met,
+    `replicates` being the maximum. `kpis` are passed to EnsembleStats.
+    """
+
+    def __init__(self, points, make_trial, replicates=1, checkpoint=None,
+                 names=None, seed=0, stopping=None, batch_size=8, kpis=None):
+        if replicates <= 0:
+            raise ValueError("replicates must be positive, got %s" % replicates)
+        self.points = list(points)
+        self.make_trial = make_trial
+        self.replicates = replicates
+        self.checkpoint = checkpoint
+        self.names = names
+        self.seed = seed
+        self.stopping = stopping
+        self.batch_size = batch_size if stopping else replicates
+        self.kpis = kpis
+
+    def load_checkpoint(self):
+        results = {}
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return results
+        with open(self.checkpoint, 'rt') as checkpoint_file:
+            for line in checkpoint_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a line cut short by a crash, that point is rerun
+                    continue
+                results[record['key']] = record
+        return results
+
+    def _record(self, key, stats, seeds):
+        record = {'key': key, 'point': json.loads(key), 'runs': stats.count,
+                  'replicates': sorted(seeds), 'link_ids': {}, 'mean': {}, 'std': {}}
+        if self.stopping is not None:
+            record['converged'] = self.stopping.converged(stats)
+        for name in stats.stats:
+            link_ids = stats.link_ids[name]
+            record['link_ids'][name] = link_ids.tolist() if link_ids is not None else None
+            record['mean'][name] = stats[name].mean.tolist()
+            record['std'][name] = stats[name].std.tolist()
+        return record
+
+    def _open_checkpoint(self):
+        if not self.checkpoint:
+            return None
+        checkpoint_file = open(self.checkpoint, 'a+t')
+        # terminate a line cut short by a crash before appending to it
+        if checkpoint_file.tell() > 0:
+            checkpoint_file.seek(checkpoint_file.tell() - 1)
+            if checkpoint_file.read(1) != "\n":
+                checkpoint_file.write("\n")
+        return checkpoint_file
+
+    def _write(self, checkpoint_file, record):
+        if checkpoint_file is not None:
+            checkpoint_file.write(json.dumps(record) + "\n")
+            checkpoint_file.flush()
+
+    def _submit(self, pool, tasks, key, point, count):
+        seeds = [self.seed + replicate for replicate in
+                 range(count, min(count + self.batch_size, self.replicates))]
+        task_ids = pool.submit_many([self.make_trial(point, seed) for seed in seeds])
+        for task_id, seed in zip(task_ids, seeds):
+            tasks[task_id] = (key, seed)
+        return len(seeds)
+
+    def _finished(self, stats):
+        if stats.count >= self.replicates:
+            return True
+        return self.stopping is not None and self.stopping.converged(stats)
+
+    def iter_points(self, pool, points):
+        """Runs the replicates of every point, yielding (key, EnsembleStats,
+        the seeds passed to make_trial) as each point finishes."""
+        points = dict((point_key(point), point) for point in points)
+        tasks = {}
+        outstanding = {}
+        stats = {}
+        seeds = {}
+        for key, point in points.items():
+            stats[key] = EnsembleStats(names=self.names, kpis=self.kpis)
+            seeds[key] = []
+            outstanding[key] = self._submit(pool, tasks, key, point, 0)
+        while tasks:
+            task_id, output = pool.collect()
+            key, seed = tasks.pop(task_id)
+            stats[key].update(output)
+            seeds[key].append(seed)
+            outstanding[key] -= 1
+            if outstanding[key] > 0:
+                continue
+            # a whole batch is in, stop or queue the next one
+            if self._finished(stats[key]):
+                yield key, stats.pop(key), seeds.pop(key)
+            else:
+                outstanding[key] = self._submit(pool, tasks, key, points[key],
+                                                stats[key].count)
+
+    def run(self, pool):
+        """Runs the missing points, returns {point key: record} for the
+        whole design."""
+        results = self.load_checkpoint()
+        pending = [point for point in self.points if point_key(point) not in results]
+
+        checkpoint_file = self._open_checkpoint()
+        try:
+            for key, stats, seeds in self.iter_points(pool, pending):
+                results[key] = self._record(key, stats, seeds)
+                self._write(checkpoint_file, results[key])
+        finally:
+            if checkpoint_file is not None:
+                checkpoint_file.close()
+        return results
+
+
+def run_replicates(pool, make_trial, replicates, stopping=None, batch_size=8,
+                   names=None, kpis=None, seed=0):
+    """EnsembleStats of up to `replicates` runs of `make_trial(seed)`,
+    stopping early once `stopping` is met, see ParameterSweep."""
+    sweep = ParameterSweep([{}], lambda point, seed: make_trial(seed), replicates,
+                           names=names, seed=seed, stopping=stopping,
+                           batch_size=batch_size, kpis=kpis)
+    for _, stats, _ in sweep.iter_points(pool, sweep.points):
+        return stats
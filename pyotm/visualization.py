@@ -9,6 +9,8 @@ import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 from matplotlib.collections import LineCollection
 import matplotlib as mpl
+
+from pyotm.network import Network
 # mpl.use('Agg')
 
 
@@ -39,8 +41,11 @@ def plot_graph(G, bbox=None, fig_height=10, fig_width=None, margin=0.02,
                edge_color='#999999', edge_linewidth=1, edge_alpha=1,
                use_geom=True, offset=False):
 
-    node_Xs = [float(x) for _, x in G.nodes(data='x')]
-    node_Ys = [float(y) for _, y in G.nodes(data='y')]
+    if isinstance(G, Network):
+        node_Xs, node_Ys = G.node_xy[:, 0], G.node_xy[:, 1]
+    else:
+        node_Xs = [float(x) for _, x in G.nodes(data='x')]
+        node_Ys = [float(y) for _, y in G.nodes(data='y')]
 
     # get north, south, east, west values either from bbox parameter or from the
     # spatial extent of the edges' geometries
@@ -63,7 +68,11 @@ def plot_graph(G, bbox=None, fig_height=10, fig_width=None, margin=0.02,
 
     # draw the edges as lines from node to node
     lines = []
-    for u, v, data in G.edges(keys=False, data=True):
+    if isinstance(G, Network):
+        # straight from the coordinate buffer
+        lines = G.lines() if use_geom else list(
+            G.node_xy[np.column_stack([G.source, G.target])])
+    for u, v, data in ([] if isinstance(G, Network) else G.edges(keys=False, data=True)):
         if 'geometry' in data and use_geom:
             # if it has a geometry attribute (a list of line segments), add them
             # to the list of lines to plot
@@ -131,7 +140,7 @@ def plot_graph(G, bbox=None, fig_height=10, fig_width=None, margin=0.02,
         fig.canvas.draw()
     else:
         # if the graph is not projected, conform the aspect ratio to not stretch the plot
-        if G.graph['crs'] == settings.default_crs:
+        if G.graph.get('crs') == settings.default_crs:
             coslat = np.cos((min(node_Ys) + max(node_Ys)) / 2. / 180. * np.pi)
             ax.set_aspect(1. / coslat)
             fig.canvas.draw()
@@ -1,10 +1,16 @@
 import inspect  # SHOULD BE REMOVED
 from igraph import read, OUT, IN
 from lxml.etree import Element, SubElement, tostring, ElementTree
-from shapely.wkt import loads
 import itertools
+import sys
 import os
 import numpy as np
+import shapely
+
+if not __package__:
+    # run as a script, python pyotm/writer.py graph.graphml
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pyotm.xmlstream import Section, write_xml
 
 # x0 = 290800
 # y0 = 1621000
@@ -79,140 +85,250 @@ def num_out_link_lanes(num_lanes, num_left_lanes=1, num_right_lanes=1):
         FORWARD: "%d#%d" % (1, num_lanes)
     }
 
+def bulk_points(geometries):
+    """Vertices of the LineStrings with more than two points among
+    `geometries` (WKT, WKB or shapely objects), decoded in bulk.
+
+    Returns the positions of those geometries, offsets into the rows of
+    `coords` (one more than the positions) and the (N, 2) `coords`. WKT
+    lines with a single comma are two-point lines and are not parsed."""
+    positions, wkt, wkb, shapes = [], [], [], []
+    for position, geometry in enumerate(geometries):
+        if isinstance(geometry, str):
+            if geometry.count(',') < 2:
+                continue
+            wkt.append(len(positions))
+        elif isinstance(geometry, bytes):
+            wkb.append(len(positions))
+        elif geometry is not None:
+            shapes.append(len(positions))
+        else:
+            continue
+        positions.append(position)
+    parsed = np.empty(len(positions), dtype=object)
+    for slots, parse in ((wkt, shapely.from_wkt), (wkb, shapely.from_wkb), (shapes, None)):
+        if slots:
+            selected = [geometries[positions[slot]] for slot in slots]
+            parsed[slots] = parse(selected) if parse else selected
+    coords, index = shapely.get_coordinates(parsed, return_index=True)
+    counts = np.bincount(index, minlength=len(positions))
+    keep = counts > 2
+    rows = np.repeat(keep, counts)
+    offsets = np.zeros(keep.sum() + 1, dtype=np.int64)
+    np.cumsum(counts[keep], out=offsets[1:])
+    return np.asarray(positions, dtype=np.int64)[keep].tolist(), offsets.tolist(), coords[rows]
+
+
 def csv2string(data):
     return ','.join(map(str, data))
 
 
+def link_types_of(graph):
+    """{(capacity, speed): road param} of the links of `graph`, numbered in
+    order of first appearance."""
+    link_types = {}
+    for capacity, speed in zip(graph.es['capacity_lane_hour'], graph.es['speed']):
+        if (capacity, speed) not in link_types:
+            i = len(link_types)
+            link_types[(capacity, speed)] = {"capacity": capacity,
+                                             "speed": speed,
+                                             "name": "link type %d" % i,
+                                             "id": i}
+    return link_types
+
+
 class OTM_Model():
-    def __init__(self, graph):
-        self.scenario = Element("scenario")
+    """Scenario generated from an igraph graph (or a pyotm Network).
+
+    The scenario is kept as a list of Sections whose elements are only
+    created while `write` streams them to the file, so memory does not
+    grow with the size of the XML. `scenario` builds the whole lxml tree
+    when it is needed.
+
+    `link_types` and `road_connection_map` may be given when they are
+    already known (see pyotm.pipeline); without `with_network` the model
+    starts with no sections at all."""
+
+    def __init__(self, graph, link_types=None, road_connection_map=None, with_network=True):
+        if hasattr(graph, 'to_igraph'):
+            # a pyotm.network.Network, not imported here as it needs networkx
+            graph = graph.to_igraph()
+        self.sections = []
         self.road_connection_map = {}
         self.graph = graph
-        self.add_network(self.graph)
+        if with_network:
+            self.add_network(self.graph, link_types, road_connection_map)
 
-    def nodes2xml(self, nodes):
-        xnodes = Element('nodes')
+    @property
+    def scenario(self):
+        return Section("scenario", lambda: self.sections).to_element()
+
+    def iter_nodes(self, nodes):
         for v in nodes:
             # if v.index in node_list:
-            xnode = SubElement(xnodes, 'node', {
+            yield Element('node', {
                 'id': str(v.index),
                 'x': str(float(v["x"])),
                 'y': str(float(v["y"]))
             })
-        return xnodes
 
-    def links2xml(self, links, link_types):
-        """Assumes `links` is a list of graphml edges"""
-        xlinks = Element('links')
-        for e in links:
-            linkid = e.index
-            xlink = Element('link')
-            xlinks.append(xlink)
-            xlink.set('id', str(linkid))
-            # length in meters --- FIX THIS
-            xlink.set('length', str(float(e['length'])))
-            xlink.set('full_lanes', str(e['lanes']))  # number of lanes
-            xlink.set('start_node_id', str(e.source))
-            xlink.set('end_node_id', str(e.target))
-            xlink.set('roadparam', str(
-                link_types[(e["capacity_lane_hour"], e["speed"])]["id"]))
-            geom_x, geom_y = loads(e['geometry']).xy
-            if len(geom_x) > 2:
-                points = Element('points')
-                xlink.append(points)
-                for x, y in zip(geom_x, geom_y):
-                    point = Element('point')
-                    point.set('x', str(x))
-                    point.set('y', str(y))
-                    points.append(point)
-        return xlinks
-
-    def add_network(self, graph):
-        # network ---------------------
-        xnetwork = Element('network')
-
-        # nodes ........................
-        xnetwork.append(self.nodes2xml(graph.vs))
-
-        link_types = {(capacity, speed): {"capacity": capacity,
-                                          "speed": speed,
-                                          "name": "link type %d" % i,
-                                          "id": i} for i, (capacity, speed) in
-                      enumerate(list(set(zip(graph.es['capacity_lane_hour'], graph.es['speed']))))}
-        # links .........................
-        xnetwork.append(self.links2xml(links=graph.es, link_types=link_types))
-
-        # road params .......................
-        xnetwork.append(self.roadparams2xml(link_types))
+    def nodes2xml(self, nodes):
+        return Section('nodes', lambda: self.iter_nodes(nodes)).to_element()
+
+    def iter_links(self, links, link_types, chunk_size=10000):
+        """Assumes `links` is an igraph EdgeSeq of graphml edges. The
+        geometries are decoded `chunk_size` links at a time."""
+        edgelist = links.graph.get_edgelist()
+        indices = links.indices
+        lengths, lanes = links['length'], links['lanes']
+        roadparams = [link_types[link_type]["id"] for link_type in
+                      zip(links["capacity_lane_hour"], links["speed"])]
+        geometries = links['geometry']
+        for start in range(0, len(indices), chunk_size):
+            positions, offsets, coords = bulk_points(geometries[start:start + chunk_size])
+            points_of = dict(zip(positions, zip(offsets[:-1], offsets[1:])))
+            # str of Python floats, as written by the per-point code before
+            text = [str(value) for value in coords.ravel().tolist()]
+            for k, idx in enumerate(indices[start:start + chunk_size], start):
+                source, target = edgelist[idx]
+                xlink = Element('link', {
+                    'id': str(idx),
+                    # length in meters --- FIX THIS
+                    'length': str(float(lengths[k])),
+                    'full_lanes': str(lanes[k]),  # number of lanes
+                    'start_node_id': str(source),
+                    'end_node_id': str(target),
+                    'roadparam': str(roadparams[k])
+                })
+                if k - start in points_of:
+                    points = SubElement(xlink, 'points')
+                    first, last = points_of[k - start]
+                    for point in range(first, last):
+                        SubElement(points, 'point', {'x': text[2*point], 'y': text[2*point + 1]})
+                yield xlink
 
-        # road connections .......................
+    def links2xml(self, links, link_types):
+        return Section('links', lambda: self.iter_links(links, link_types)).to_element()
 
-        # add only the road connections needed for the paths
-        # create a map from node id to road connections in that node
-        for edge_id, edge in enumerate(graph.es):
-            target_node = edge.target
-            source_node = edge.source
-            edge_direction = float(edge['direction'])
-            edge_lanes = int(edge["lanes"])
-            # up_links = graph.incident(node_id, mode=IN)
-            down_links = graph.incident(target_node, mode=OUT)
-            in_link_lanes = num_in_link_lanes(edge_lanes)
-            for link_id in down_links:
-                link = graph.es[link_id]
-                link_lanes = int(link["lanes"])
-                if link.target == source_node:
-                    continue
-                link_direction = float(link['direction'])
-                turn = what_turn(link_direction-edge_direction)
-                out_link_lanes = num_out_link_lanes(link_lanes)
-                connection_info = {"in_link": {"id": edge_id},
-                                   "out_link":  {"id": link_id},
-                                   "in_link_lanes": in_link_lanes[turn],
-                                   "out_link_lanes": out_link_lanes[turn],
-                                   "direction": edge_direction,
-                                   "dir_txt": edge['dir_txt'],
-                                   "turn": turn
-                                   }
-
-                self.road_connection_map[target_node] = self.road_connection_map.get(
-                    target_node, {})
-                node_map = self.road_connection_map[target_node]
-                node_map[edge_id] = node_map.get(
-                    edge_id, []) + [connection_info]
-
-        # road connections to xml
-        xnetwork.append(self.roadconnections2xml(self.road_connection_map))
-        self.scenario.append(xnetwork)
+    def add_network(self, graph, link_types=None, road_connection_map=None):
+        if link_types is None:
+            link_types = link_types_of(graph)
 
-    def roadconnections2xml(self, road_connection_map):
+        # road connections .......................
+        if road_connection_map is None:
+            road_connection_map = self.connection_map(graph)
+        self.road_connection_map = road_connection_map
+        # needed by add_controllers before anything is written
+        self.phases = self.phases_of(self.road_connection_map)
+
+        # network: nodes, links, road params and road connections
+        self.sections.append(Section('network', lambda: [
+            Section('nodes', lambda: self.iter_nodes(graph.vs)),
+            Section('links', lambda: self.iter_links(graph.es, link_types)),
+            Section('roadparams', lambda: self.iter_roadparams(link_types)),
+            Section('roadconnections',
+                    lambda: self.iter_roadconnections(self.road_connection_map))]))
+
+    def road_connections(self, graph):
+        """Every (in link, out link) pair meeting at a node, U-turns
+        excluded, in edge id order of the in link and incident order of the
+        out links. Returns columns: node, in link, out link, in/out lane
+        strings, in link direction and dir_txt, and turn."""
+        num_edges = graph.ecount()
+        edges = np.array(graph.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+        source, target = edges[:, 0], edges[:, 1]
+        direction = np.array(graph.es['direction'], dtype=float) if num_edges else np.zeros(0)
+        lanes = np.array([int(lanes) for lanes in graph.es['lanes']], dtype=np.int64)
+
+        # out links of all nodes in one flat array, in incident order
+        inclist = graph.get_inclist(mode=OUT)
+        degree = np.array([len(links) for links in inclist], dtype=np.int64)
+        offsets = np.zeros(len(inclist) + 1, dtype=np.int64)
+        np.cumsum(degree, out=offsets[1:])
+        out_links = np.fromiter(itertools.chain.from_iterable(inclist), dtype=np.int64,
+                                count=offsets[-1])
+
+        # each in link joined with every out link of its target node
+        counts = degree[target]
+        in_link = np.repeat(np.arange(num_edges), counts)
+        position = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        out_link = out_links[offsets[target[in_link]] + position]
+        keep = target[out_link] != source[in_link]
+        in_link, out_link = in_link[keep], out_link[keep]
+
+        # what_turn over all pairs at once
+        dirs = np.array([LEFT, FORWARD, RIGHT])
+        angle = (direction[out_link] - direction[in_link]) % (2*np.pi)
+        turn = dirs[np.argmin(np.abs(angle[:, None] - dirs[None, :]), axis=1)]
+
+        in_lanes, out_lanes = {}, {}
+        for num_lanes in np.unique(lanes).tolist():
+            in_lanes[num_lanes] = num_in_link_lanes(num_lanes)
+            out_lanes[num_lanes] = num_out_link_lanes(num_lanes)
+        turns = turn.tolist()
+        in_lane_counts, out_lane_counts = lanes[in_link].tolist(), lanes[out_link].tolist()
+        dir_txt = graph.es['dir_txt'] if num_edges else []
+        in_links = in_link.tolist()
+        return (target[in_link].tolist(), in_links, out_link.tolist(),
+                [in_lanes[n][t] for n, t in zip(in_lane_counts, turns)],
+                [out_lanes[n][t] for n, t in zip(out_lane_counts, turns)],
+                direction[in_link].tolist(), [dir_txt[link] for link in in_links], turns)
+
+    def connection_map(self, graph):
+        """{node: {in link: [connection info]}} of all road connections of
+        `graph`."""
+        road_connection_map = {}
+        for node_id, in_link, out_link, in_lanes, out_lanes, direction, dir_txt, turn in zip(
+                *self.road_connections(graph)):
+            connection_info = {"in_link": {"id": in_link},
+                               "out_link": {"id": out_link},
+                               "in_link_lanes": in_lanes,
+                               "out_link_lanes": out_lanes,
+                               "direction": direction,
+                               "dir_txt": dir_txt,
+                               "turn": turn
+                               }
+            node_map = road_connection_map.setdefault(node_id, {})
+            node_map.setdefault(in_link, []).append(connection_info)
+        return road_connection_map
+
+    def iter_roadconnections(self, road_connection_map):
         c = -1
-        self.phases = {}
-        xroadconnections = Element('roadconnections')
         for node_id, in_links in road_connection_map.items():
-            self.phases[node_id] = {}
             for in_link_id, tuple_list in in_links.items():
                 for in_out_link in tuple_list:
                     c += 1
-                    xroad_con = Element('roadconnection')
-                    xroadconnections.append(xroad_con)
-                    xroad_con.set('id', str(c))
-                    xroad_con.set('in_link', str(in_out_link["in_link"]["id"]))
-                    xroad_con.set('out_link', str(
-                        in_out_link["out_link"]["id"]))
-                    xroad_con.set('in_link_lanes',
-                                  (in_out_link["in_link_lanes"]))
-                    xroad_con.set('out_link_lanes',
-                                  (in_out_link["out_link_lanes"]))
+                    yield Element('roadconnection', {
+                        'id': str(c),
+                        'in_link': str(in_out_link["in_link"]["id"]),
+                        'out_link': str(in_out_link["out_link"]["id"]),
+                        'in_link_lanes': in_out_link["in_link_lanes"],
+                        'out_link_lanes': in_out_link["out_link_lanes"]
+                    })
+
+    def phases_of(self, road_connection_map):
+        """{node: {turn direction: road connection id}}, the connection ids
+        as numbered by iter_roadconnections."""
+        c = -1
+        phases = {}
+        for node_id, in_links in road_connection_map.items():
+            node_phases = phases[node_id] = {}
+            for in_link_id, tuple_list in in_links.items():
+                for in_out_link in tuple_list:
+                    c += 1
                     turn_direction = DIRECTIONS.get((in_out_link["dir_txt"], in_out_link["turn"]), None)
                     if turn_direction is not None:
-                        self.phases[node_id][turn_direction] = c
-        return xroadconnections
+                        node_phases[turn_direction] = c
+        return phases
 
-    def roadparams2xml(self, link_types):
-        xroadparams = Element('roadparams')
+    def roadconnections2xml(self, road_connection_map):
+        self.phases = self.phases_of(road_connection_map)
+        return Section('roadconnections',
+                       lambda: self.iter_roadconnections(road_connection_map)).to_element()
+
+    def iter_roadparams(self, link_types):
         for info in link_types.values():
             xroadparam = Element('roadparam')
-            xroadparams.append(xroadparam)
             xroadparam.set('id', str(info["id"]))
             xroadparam.set('name', info["name"])
             road_capacity = float(info["capacity"])
@@ -221,127 +337,114 @@ class OTM_Model():
             xroadparam.set('capacity', str(road_capacity))     # veh/hr/lane
             xroadparam.set('jam_density', str(
                 road_capacity/road_speed*5))   # veh/km/lane
-        return xroadparams
+            yield xroadparam
 
-    def add_splits(self):
-        xsplits = Element("splits")
-        self.scenario.append(xsplits)
-        for node_id, node in enumerate(graph.vs):
-            up_links = graph.incident(node_id, mode=IN)
-            down_links = graph.incident(node_id, mode=OUT)
-            for up_link in up_links:
-                if len(down_links) > 1:
-                    xsplit_node = Element('split_node')
-                    xsplit_node.set('node_id', str(node_id))
-                    xsplit_node.set('commodity_id', '0')
-                    xsplit_node.set('link_in', str(up_link))
-                    for down_link in down_links:
-                        xsplit = Element('split')
-                        xsplit.set('link_out', str(down_link))
+    def roadparams2xml(self, link_types):
+        return Section('roadparams', lambda: self.iter_roadparams(link_types)).to_element()
+
+    def iter_splits(self, ratios=None):
+        """Even splits at every node with more than one out link, except
+        for the (node, in link) pairs in `ratios`, which map to
+        {out link: ratio} (out links not listed get 0)."""
+        ratios = ratios or {}
+        graph = self.graph
+        for node_id, down_links in enumerate(graph.get_inclist(mode=OUT)):
+            if len(down_links) <= 1:
+                continue
+            for up_link in graph.incident(node_id, mode=IN):
+                xsplit_node = Element('split_node')
+                xsplit_node.set('node_id', str(node_id))
+                xsplit_node.set('commodity_id', '0')
+                xsplit_node.set('link_in', str(up_link))
+                node_ratios = ratios.get((node_id, up_link))
+                for down_link in down_links:
+                    xsplit = SubElement(xsplit_node, 'split')
+                    xsplit.set('link_out', str(down_link))
+                    if node_ratios is None:
                         xsplit.text = str(1/len(down_links))
-                        xsplit_node.append(xsplit)
-                    xsplits.append(xsplit_node)
+                    else:
+                        xsplit.text = str(node_ratios.get(down_link, 0.0))
+                yield xsplit_node
+
+    def add_splits(self, ratios=None):
+        self.sections.append(Section("splits", lambda: self.iter_splits(ratios)))
 
     def add_demands(self, source_node, demand_ts, demand_dt):
         links = self.graph.es
-        nodes = self.graph.vs
-        xsubnetworks = Element('subnetworks')
-        xdemands = Element('demands')
-        self.scenario.append(xsubnetworks)
-        self.scenario.append(xdemands)
         xsubnetwork = Element('subnetwork')
-        xsubnetworks.append(xsubnetwork)
         xsubnetwork.set('id', str(1))
-        xsubnetwork.text = csv2string([e.index for e in links])
+        xsubnetwork.text = csv2string(range(len(links)))
+        self.sections.append(Section('subnetworks', lambda: [xsubnetwork]))
 
         xdemand = Element('demand')
-        xdemands.append(xdemand)
         xdemand.set('commodity_id', "0")
         xdemand.set('subnetwork', str(1))
         xdemand.set('start_time', "0")
-        xdemand.set('link_id', str(graph.incident(source_node, mode=OUT)[0]))
+        xdemand.set('link_id', str(self.graph.incident(source_node, mode=OUT)[0]))
         xdemand.set('dt', str(demand_dt))
         xdemand.text = csv2string(demand_ts)
+        self.sections.append(Section('demands', lambda: [xdemand]))
 
-    def add_controllers(self):
-        xactuators =  Element('actuators')
-        self.scenario.append(xactuators)
-        xsensors =  Element('sensors')
-        self.scenario.append(xsensors)
-        xcontrollers =  Element('controllers')
-        self.scenario.append(xcontrollers)
-        xcontroller = Element('controller')
-        xcontrollers.append(xcontroller)
-
-        xtarget_actuators = Element('target_actuators')
-        xcontroller.append(xtarget_actuators)
-        xfeedback_sensors = Element('feedback_sensors')
-        xcontroller.append(xfeedback_sensors)
-        xcontroller.set('id', str(0))
-        xcontroller.set('type', 'linkpressure')
-        xcontroller.set('dt', '10')
-        #Acutators
+    def iter_actuators(self):
         for actuator_id, (nodeid, _) in enumerate(self.phases.items()):
             # nodeid = node.index
 
             xactuator = Element('actuator')
-            xactuators.append(xactuator)
             xactuator.set('id', str(actuator_id))
             xactuator.set('type', 'signal')
             # xactuator.set('dt', '30')
-            xactuator_target = Element('actuator_target')
-            xactuator.append(xactuator_target)
+            xactuator_target = SubElement(xactuator, 'actuator_target')
             xactuator_target.set('type','node')
             xactuator_target.set('id', str(nodeid))
 
-            xsignal = Element('signal')
-            xactuator.append(xsignal)
+            xsignal = SubElement(xactuator, 'signal')
             for phase_id, (phase_name, rcs) in enumerate(phase_combos.items()):
                 roadconns = [self.phases[nodeid].get(i, None) for i in rcs if self.phases[nodeid].get(i, None) is not None]
                 if roadconns:
-                    xphase = Element("phase")
-                    xsignal.append(xphase)
+                    xphase = SubElement(xsignal, "phase")
                     xphase.set('id', str(phase_id))
                     xphase.set("yellow_time", "3")
                     xphase.set("red_clear_time", "2")
                     xphase.set("min_green_time", "5")
                     xphase.set("roadconnection_ids", csv2string(roadconns))
-            xtarget_actuator = Element('target_actuator')
-            xtarget_actuators.append(xtarget_actuator)
-            xtarget_actuator.set('id', str(actuator_id))
-            xtarget_actuator.set('usage', str(nodeid))
+            yield xactuator
+
+    def iter_target_actuators(self):
+        for actuator_id, nodeid in enumerate(self.phases):
+            yield Element('target_actuator', {'id': str(actuator_id), 'usage': str(nodeid)})
+
+    def iter_sensors(self):
+        for sensor_id in range(self.graph.ecount()):
+            yield Element('sensor', {'id': str(sensor_id), 'type': 'fixed', 'dt': '10',
+                                     'link_id': str(sensor_id)})
+
+    def iter_feedback_sensors(self):
+        for sensor_id in range(self.graph.ecount()):
+            yield Element('feedback_sensor', {'id': str(sensor_id), 'usage': str(sensor_id)})
 
+    def add_controllers(self):
+        #Acutators
+        self.sections.append(Section('actuators', self.iter_actuators))
         #sensors
-        for sensor_id, link in enumerate(graph.es):
-            linkid = link.index
-            xsensor = Element('sensor')
-            xsensors.append(xsensor)
-            xsensor.set('id', str(sensor_id))
-            xsensor.set('type', 'fixed')
-            xsensor.set('dt', '10')
-            xsensor.set('link_id', str(linkid))
-            xfeedback_sensor = Element('feedback_sensor')
-            xfeedback_sensors.append(xfeedback_sensor)
-            xfeedback_sensor.set('id', str(sensor_id))
-            xfeedback_sensor.set('usage', str(sensor_id))
+        self.sections.append(Section('sensors', self.iter_sensors))
+        self.sections.append(Section('controllers', lambda: [
+            Section('controller', lambda: [
+                Section('target_actuators', self.iter_target_actuators),
+                Section('feedback_sensors', self.iter_feedback_sensors)],
+                {'id': str(0), 'type': 'linkpressure', 'dt': '10'})]))
 
     def add_plugins(self):
-        xplugins = Element('plugins')
-        self.scenario.append(xplugins)
         xplugin = Element('plugin')
-        xplugins.append(xplugin)
         xplugin.set('name', 'linkpressure')
         xplugin.set('folder', "/Users/acbalingit/Projects/otm/otm-plugin/target/otm-plugin-1.0-SNAPSHOT.jar")
         xplugin.set('class', 'controller.ControllerSignalPretimedTest')
+        self.sections.append(Section('plugins', lambda: [xplugin]))
 
     # def add_phases(self):
-        
-    def write(self, filename, pretty_print=True):
+
+    def add_model(self):
         # # MN model --------------------
-        xmodels = Element('models')
-        self.scenario.append(xmodels)
         xmodel = Element('model')
-        xmodels.append(xmodel)
         xmodel.set("type", "ctm")
         xmodel.set("name", "myctm")
         xmodel.set("is_default", "true")
@@ -350,16 +453,21 @@ class OTM_Model():
         xmn.set('max_cell_length', '100')  # m
         xmn.set('sim_dt', '2')  # m
         # xmn.text = csv2string([e.index for e in self.graph.es])
+        self.sections.append(Section('models', lambda: [xmodel]))
 
         # commodities ---------------------
-        xcommodities = Element('commodities')
-        self.scenario.append(xcommodities)
         xcommodity = Element('commodity')
-        xcommodities.append(xcommodity)
         xcommodity.set('id', '0')
         xcommodity.set('name', 'car')
         xcommodity.set('subnetworks', '1')
-        ElementTree(self.scenario).write(filename, pretty_print=pretty_print)
+        self.sections.append(Section('commodities', lambda: [xcommodity]))
+
+    def write(self, filename, pretty_print=True):
+        """Streams the scenario to `filename`, adding the model and
+        commodity on the first call."""
+        if not any(section.tag == 'models' for section in self.sections):
+            self.add_model()
+        write_xml(filename, Section("scenario", lambda: self.sections), pretty_print)
 
 
 # write the scenario to an xml file
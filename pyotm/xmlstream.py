@@ -0,0 +1,117 @@
+#!/usr/bin/env/python
+"""Streaming XML output for scenario files.
+
+A scenario is described as nested Sections whose children are produced
+on demand, and `write_xml` emits it with lxml's incremental `xmlfile`, so
+only the element being written is held in memory rather than the whole
+tree. With `pretty_print` the output is the same as
+`ElementTree(tree).write(output, pretty_print=True)`.
+
+    root = Section('scenario', lambda: [
+        Section('network', lambda: [Section('nodes', iter_nodes)]),
+        Section('demands', iter_demands)])
+    write_xml('scenario.xml', root)
+
+Sections that do not change between writes can be rendered once and
+passed back as Fragments, which are copied to the output as they are.
+"""
+import itertools
+import io
+
+from lxml import etree
+
+from pyotm.compression import open_scenario
+
+
+INDENT = '  '
+
+
+class Section(object):
+    """Element `tag` whose children (Elements, Sections or Fragments) come from
+    calling `children`, which is only done while the section is written.
+    A callable returning a generator keeps the section lazy, a list works
+    too."""
+
+    def __init__(self, tag, children=None, attrib=None):
+        self.tag = tag
+        self.children = children
+        self.attrib = attrib or {}
+
+    def iter_children(self):
+        return iter(self.children() if self.children is not None else ())
+
+    def to_element(self):
+        """The whole section as one lxml tree."""
+        element = etree.Element(self.tag, self.attrib)
+        for child in self.iter_children():
+            if isinstance(child, Fragment):
+                child = etree.fromstring(child.data)
+            elif isinstance(child, Section):
+                child = child.to_element()
+            element.append(child)
+        return element
+
+
+class Fragment(object):
+    """A child already rendered with `render`, written out as it is. The
+    bytes carry the indentation of the depth they were rendered at."""
+
+    def __init__(self, data):
+        self.data = data
+
+
+def _write_element(xf, element, depth, pretty_print):
+    if pretty_print:
+        etree.indent(element, INDENT, level=depth)
+    xf.write(element)
+
+
+def _write_section(xf, output, section, depth, pretty_print):
+    children = section.iter_children()
+    first = next(children, None)
+    if first is None:
+        # written as <tag/> like an empty element of a tree
+        _write_element(xf, etree.Element(section.tag, section.attrib), depth, pretty_print)
+        return
+    with xf.element(section.tag, section.attrib):
+        for child in itertools.chain([first], children):
+            if pretty_print:
+                xf.write('\n' + INDENT * (depth + 1))
+            if isinstance(child, Fragment):
+                xf.flush()
+                output.write(child.data)
+            elif isinstance(child, Section):
+                _write_section(xf, output, child, depth + 1, pretty_print)
+            else:
+                _write_element(xf, child, depth + 1, pretty_print)
+        if pretty_print:
+            xf.write('\n' + INDENT * depth)
+
+
+def _write(output, root, depth, pretty_print, **kwargs):
+    with etree.xmlfile(output, **kwargs) as xf:
+        if isinstance(root, Section):
+            _write_section(xf, output, root, depth, pretty_print)
+        else:
+            _write_element(xf, root, depth, pretty_print)
+
+
+def render(section, depth=1, pretty_print=True, **kwargs):
+    """`section` (or an Element) as bytes, indented for `depth` levels
+    below the root, to be written again later as a Fragment."""
+    output = io.BytesIO()
+    _write(output, section, depth, pretty_print, **kwargs)
+    return output.getvalue()
+
+
+def write_xml(output, root, pretty_print=True, **kwargs):
+    """Writes `root` (a Section or an Element) to a filename or a binary
+    file object; .gz and .zst filenames are compressed on the fly. Extra
+    arguments go to `lxml.etree.xmlfile`, e.g. `encoding`."""
+    if isinstance(output, str):
+        with open_scenario(output, 'wb') as output_file:
+            return write_xml(output_file, root, pretty_print, **kwargs)
+    _write(output, root, 0, pretty_print, **kwargs)
+    if pretty_print:
+        # xmlfile takes nothing after the root element
+        output.write(b'\n')